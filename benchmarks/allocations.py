@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+
+# allocations.py
+#
+# Copyright 2022 Fyodor Sobolev
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE X CONSORTIUM BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# Except as contained in this notice, the name(s) of the above copyright
+# holders shall not be used in advertising or otherwise to promote the sale,
+# use or other dealings in this Software without prior written
+# authorization.
+#
+# SPDX-License-Identifier: MIT
+
+# Checks that drawing a frame and reading a frame from cava don't churn
+# memory: no garbage collections are triggered, nothing is left behind and
+# temporary allocations stay small. Every drawing mode is checked with and
+# without pixel snapping, along with reading frames through Cava.read().
+# Usage:
+#
+#   python3 benchmarks/allocations.py [--frames N] [--bars N]
+#
+# Exits with non-zero status if any case is over the limits.
+
+import gc
+import os
+import sys
+import argparse
+import threading
+import tracemalloc
+from array import array
+import cairo
+from common import load_cavalier, make_sample, modes
+
+load_cavalier()
+from cavalier.cava import Cava
+
+# Bytes per frame left behind that are tolerated, e.g. for caches
+# warming up
+LIMIT = 64
+# Bytes allocated at once above the starting point, including buffers
+# allocated once per cava process
+PEAK_LIMIT = 64 * 1024
+
+class Tracker:
+    # Garbage collections of the youngest generation, bytes left behind
+    # and peak of bytes allocated at once between start() and stop()
+    def start(self):
+        gc.collect()
+        tracemalloc.start()
+        self.collections = gc.get_stats()[0]['collections']
+        (self.current, peak) = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+
+    def stop(self, frames):
+        (current, peak) = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        collections = gc.get_stats()[0]['collections'] - self.collections
+        return ((current - self.current) / frames, peak - self.current, \
+            collections)
+
+def measure_draw(draw, bars, frames, width=800, height=400):
+    surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, width, height)
+    cr = cairo.Context(surface)
+    samples = [make_sample(bars, i) for i in range(frames)]
+    # Warm up caches first
+    draw(samples[-1], cr, width, height)
+    tracker = Tracker()
+    tracker.start()
+    for sample in samples:
+        draw(sample, cr, width, height)
+    return tracker.stop(frames)
+
+class FakeProcess:
+    def __init__(self, fd):
+        self.stdout = os.fdopen(fd, 'rb', buffering=0)
+
+    def kill(self):
+        pass
+
+class FrameFeeder:
+    # Writes the next frame to the pipe only after cava published the
+    # previous one, so every frame goes through Cava.read() on its own
+    def __init__(self, fd, frames):
+        self.fd = fd
+        self.frames = frames
+        self.ready = threading.Semaphore(1)
+        self.thread = threading.Thread(target=self.run)
+
+    def publish(self, data, bars):
+        self.ready.release()
+
+    def run(self):
+        for frame in self.frames:
+            self.ready.acquire()
+            os.write(self.fd, frame)
+        # Cava exits when the pipe is closed
+        os.close(self.fd)
+
+def measure_read(bars, frames):
+    cava = Cava()
+    cava.bars = bars
+    (read_fd, write_fd) = os.pipe()
+    process = FakeProcess(read_fd)
+    feeder = FrameFeeder(write_fd, [array('H', \
+        [round(v * 65535) for v in make_sample(bars, i)]).tobytes() \
+        for i in range(frames)])
+    cava.sinks = [feeder]
+    feeder.thread.start()
+    tracker = Tracker()
+    tracker.start()
+    cava.read(process)
+    result = tracker.stop(frames)
+    feeder.thread.join()
+    process.stdout.close()
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description='Per-frame allocations')
+    parser.add_argument('--frames', type=int, default=600)
+    parser.add_argument('--bars', type=int, default=50)
+    args = parser.parse_args()
+
+    cases = [(name, lambda draw=draw: \
+        measure_draw(draw, args.bars, args.frames)) \
+        for (name, draw) in modes(args.bars, scale=2).items()]
+    cases.append(('cava-read', lambda: measure_read(args.bars, args.frames)))
+    failed = False
+    for (name, run) in cases:
+        (per_frame, peak, collections) = run()
+        ok = per_frame <= LIMIT and peak <= PEAK_LIMIT and collections == 0
+        failed = failed or not ok
+        print(f'{name}: {per_frame:.1f} bytes/frame retained, ' \
+            f'{peak} bytes peak, {collections} gc collections - ' \
+            f'{"ok" if ok else "FAIL"}')
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,94 @@
+# common.py
+#
+# Copyright 2022 Fyodor Sobolev
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE X CONSORTIUM BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# Except as contained in this notice, the name(s) of the above copyright
+# holders shall not be used in advertising or otherwise to promote the sale,
+# use or other dealings in this Software without prior written
+# authorization.
+#
+# SPDX-License-Identifier: MIT
+
+# Helpers shared by benchmark scripts.
+
+import os
+import sys
+import importlib.util
+
+COLORS = ((53, 132, 228, 1.0), (224, 27, 36, 0.5))
+
+def load_cavalier():
+    """Makes modules from src/ importable as `cavalier` package."""
+    src = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+    spec = importlib.util.spec_from_file_location('cavalier', \
+        os.path.join(src, '__init__.py'), submodule_search_locations=[src])
+    module = importlib.util.module_from_spec(spec)
+    sys.modules['cavalier'] = module
+    spec.loader.exec_module(module)
+    return module
+
+def make_sample(bars, frame):
+    # Deterministic sample that changes every frame
+    return [((i * 7 + frame * 3) % 23) / 22 for i in range(bars)]
+
+def modes(bars, offset=10, scale=1):
+    """Returns functions drawing a sample in every drawing mode.
+
+    Each function is called as `draw(sample, cr, width, height)`. Modes
+    with state (spectrogram and cached modes) keep it between calls.
+    Cached modes return False if the frame didn't need to be painted.
+    """
+    from cavalier import draw_functions
+    peaks = [1.0] * bars
+    history = draw_functions.Spectrogram(bars, COLORS)
+    def spectrogram(s, cr, w, h):
+        history.push(s)
+        draw_functions.spectrogram(history, cr, w, h)
+    def frame_cache(mode):
+        cache = draw_functions.FrameCache()
+        def draw(s, cr, w, h):
+            if not cache.update(mode, s, w, h, COLORS, offset, scale, \
+                    True, peaks):
+                return False
+            cache.paint(cr)
+            return True
+        return draw
+    return {
+        'wave': lambda s, cr, w, h: \
+            draw_functions.wave(s, cr, w, h, COLORS),
+        'wave-spline': lambda s, cr, w, h: \
+            draw_functions.wave(s, cr, w, h, COLORS, 'spline'),
+        'levels': lambda s, cr, w, h: \
+            draw_functions.levels(s, cr, w, h, COLORS, offset),
+        'bars': lambda s, cr, w, h: \
+            draw_functions.bars(s, cr, w, h, COLORS, offset),
+        'levels-snap': lambda s, cr, w, h: \
+            draw_functions.levels(s, cr, w, h, COLORS, offset, scale, True),
+        'bars-snap': lambda s, cr, w, h: \
+            draw_functions.bars(s, cr, w, h, COLORS, offset, scale, True),
+        'bars-peaks': lambda s, cr, w, h: \
+            draw_functions.bars(s, cr, w, h, COLORS, offset, scale, True, \
+            peaks),
+        'spectrogram': spectrogram,
+        'cached-levels': frame_cache('levels'),
+        'cached-bars': frame_cache('bars')
+    }
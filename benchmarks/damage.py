@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+
+# damage.py
+#
+# Copyright 2022 Fyodor Sobolev
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE X CONSORTIUM BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# Except as contained in this notice, the name(s) of the above copyright
+# holders shall not be used in advertising or otherwise to promote the sale,
+# use or other dealings in this Software without prior written
+# authorization.
+#
+# SPDX-License-Identifier: MIT
+
+# Compares drawing whole frames in "levels" and "bars" modes with drawing
+# only columns that changed since the previous frame. Usage:
+#
+#   python3 benchmarks/damage.py [--frames N] [--bars N]
+#
+# In every frame the given share of bars gets a new value, the rest keep
+# the old one. "skipped" is the number of frames that didn't need to be
+# painted at all.
+
+import sys
+import time
+import argparse
+import cairo
+from common import load_cavalier, make_sample, modes
+
+load_cavalier()
+
+SIZES = ((1280, 720), (1920, 1080), (3840, 2160))
+SHARES = (0.0, 0.1, 0.5, 1.0)
+
+def make_samples(bars, frames, share):
+    samples = [make_sample(bars, 0)]
+    changing = round(bars * share)
+    for frame in range(1, frames):
+        sample = list(samples[-1])
+        new = make_sample(bars, frame)
+        # Different bars change in every frame
+        for n in range(changing):
+            i = (frame * 7 + n) % bars
+            sample[i] = new[i]
+        samples.append(sample)
+    return samples
+
+def full(draw, samples, surface, width, height, target):
+    cr = cairo.Context(surface)
+    start = time.perf_counter()
+    for sample in samples:
+        cr.set_operator(cairo.OPERATOR_CLEAR)
+        cr.paint()
+        cr.set_operator(cairo.OPERATOR_OVER)
+        draw(sample, cr, width, height)
+        target.set_source_surface(surface, 0, 0)
+        target.paint()
+    surface.flush()
+    return (time.perf_counter() - start) * 1000 / len(samples)
+
+def damage(draw, samples, width, height, target):
+    skipped = 0
+    start = time.perf_counter()
+    for sample in samples:
+        if not draw(sample, target, width, height):
+            skipped += 1
+    return ((time.perf_counter() - start) * 1000 / len(samples), skipped)
+
+def main():
+    parser = argparse.ArgumentParser(description='Damage region benchmark')
+    parser.add_argument('--frames', type=int, default=100)
+    parser.add_argument('--bars', type=int, default=50)
+    args = parser.parse_args()
+
+    print(f'{"mode":<8} {"size":>10} {"changed":>8} {"full ms":>10} ' \
+        f'{"damage ms":>10} {"skipped":>8}')
+    for mode in ('levels', 'bars'):
+        for (width, height) in SIZES:
+            surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, width, height)
+            window = cairo.ImageSurface(cairo.FORMAT_ARGB32, width, height)
+            target = cairo.Context(window)
+            for share in SHARES:
+                samples = make_samples(args.bars, args.frames, share)
+                # Fresh cache for every run, drawn the same way as in full
+                # frames: with pixel snapping and peak caps for bars
+                drawers = modes(args.bars)
+                whole = full(drawers['levels-snap' if mode == 'levels' \
+                    else 'bars-peaks'], samples, surface, width, height, \
+                    target)
+                (partial, skipped) = damage(drawers['cached-' + mode], \
+                    samples, width, height, target)
+                print(f'{mode:<8} {f"{width}x{height}":>10} ' \
+                    f'{f"{round(share * 100)}%":>8} {whole:>10.3f} ' \
+                    f'{partial:>10.3f} {skipped:>8}')
+
+if __name__ == '__main__':
+    sys.exit(main())
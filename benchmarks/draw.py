@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+
+# draw.py
+#
+# Copyright 2022 Fyodor Sobolev
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE X CONSORTIUM BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# Except as contained in this notice, the name(s) of the above copyright
+# holders shall not be used in advertising or otherwise to promote the sale,
+# use or other dealings in this Software without prior written
+# authorization.
+#
+# SPDX-License-Identifier: MIT
+
+# Measures time needed to draw a frame in every drawing mode at different
+# sizes. Usage:
+#
+#   python3 benchmarks/draw.py [--frames N] [--bars N] [--scale N]
+#
+# For every size the table shows time of drawing directly (what happens on
+# the main thread by default) and of painting a finished frame from
+# a render worker surface (what happens on the main thread with threaded
+# rendering enabled). Modes are listed in common.py: "-snap" and "cached-"
+# ones are drawn with pixel snapping, pass --scale 2 to see how they behave
+# on HiDPI surfaces.
+
+import sys
+import time
+import argparse
+import cairo
+from common import load_cavalier, make_sample, modes
+
+load_cavalier()
+
+SIZES = ((300, 200), (1280, 720), (1920, 1080), (3840, 2160))
+
+def new_surface(width, height, scale):
+    # Same as the surfaces of a render worker on a scaled monitor
+    surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, \
+        width * scale, height * scale)
+    surface.set_device_scale(scale, scale)
+    return surface
+
+def clear(cr):
+    cr.set_operator(cairo.OPERATOR_CLEAR)
+    cr.paint()
+    cr.set_operator(cairo.OPERATOR_OVER)
+
+def time_frames(surface, frames, draw_fn):
+    cr = cairo.Context(surface)
+    start = time.perf_counter()
+    for i in range(frames):
+        clear(cr)
+        draw_fn(cr, i)
+    surface.flush()
+    return (time.perf_counter() - start) * 1000 / frames
+
+def main():
+    parser = argparse.ArgumentParser(description='Drawing benchmark')
+    parser.add_argument('--frames', type=int, default=100)
+    parser.add_argument('--bars', type=int, default=50)
+    parser.add_argument('--scale', type=int, default=1)
+    args = parser.parse_args()
+
+    samples = [make_sample(args.bars, i) for i in range(args.frames)]
+    print(f'{"mode":<12} {"size":>10} {"draw ms":>10} {"blit ms":>10}')
+    for (name, draw) in modes(args.bars, scale=args.scale).items():
+        for (width, height) in SIZES:
+            surface = new_surface(width, height, args.scale)
+            drawn = time_frames(surface, args.frames, \
+                lambda cr, i: draw(samples[i], cr, width, height))
+            frame = new_surface(width, height, args.scale)
+            draw(samples[0], cairo.Context(frame), width, height)
+            def blit(cr, i):
+                cr.set_source_surface(frame, 0, 0)
+                cr.paint()
+            blitted = time_frames(surface, args.frames, blit)
+            print(f'{name:<12} {f"{width}x{height}":>10} {drawn:>10.3f} ' \
+                f'{blitted:>10.3f}')
+
+if __name__ == '__main__':
+    sys.exit(main())
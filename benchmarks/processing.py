@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+
+# processing.py
+#
+# Copyright 2022 Fyodor Sobolev
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE X CONSORTIUM BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# Except as contained in this notice, the name(s) of the above copyright
+# holders shall not be used in advertising or otherwise to promote the sale,
+# use or other dealings in this Software without prior written
+# authorization.
+#
+# SPDX-License-Identifier: MIT
+
+# Measures time needed to post-process a frame with different parameters.
+# Post-processing runs in cava reader thread for every frame, so it has
+# to stay well below the frame period. Usage:
+#
+#   python3 benchmarks/processing.py [--frames N] [--bars N]
+#
+# Exits with non-zero status if any configuration exceeds the budget.
+
+import sys
+import time
+import argparse
+from array import array
+from common import load_cavalier, make_sample
+
+load_cavalier()
+from cavalier.post_processing import PostProcessor
+
+# Milliseconds per frame tolerated, a small part of 1/60 s
+BUDGET = 0.5
+
+CONFIGS = {
+    'identity': {},
+    'gain': {'gain': 2.0},
+    'log': {'amplitude_scale': 'log'},
+    'smoothing': {'smoothing': 0.5},
+    'gravity': {'gravity': 4.0},
+    'peak-caps': {'peak_caps': True},
+    'all': {'gain': 2.0, 'amplitude_scale': 'log', 'smoothing': 0.5, \
+        'gravity': 4.0, 'peak_caps': True}
+}
+
+def measure(config, bars, frames):
+    processor = PostProcessor()
+    for (name, value) in config.items():
+        setattr(processor, name, value)
+    processor.reset(bars)
+    # Same types as in Cava.read()
+    frames_values = [array('H', [round(v * 65535) for v in \
+        make_sample(bars, i)]) for i in range(frames)]
+    sample = array('d', bytes(8 * bars))
+    peaks = array('d', bytes(8 * bars))
+    norm = 1 / 65535
+    start = time.perf_counter()
+    for values in frames_values:
+        processor.process(values, norm, sample, peaks)
+    return (time.perf_counter() - start) * 1000 / frames
+
+def main():
+    parser = argparse.ArgumentParser(description='Post-processing benchmark')
+    parser.add_argument('--frames', type=int, default=1000)
+    parser.add_argument('--bars', type=int, default=100)
+    args = parser.parse_args()
+
+    failed = False
+    print(f'{"config":<12} {"ms/frame":>10}')
+    for (name, config) in CONFIGS.items():
+        elapsed = measure(config, args.bars, args.frames)
+        over = elapsed > BUDGET
+        failed = failed or over
+        print(f'{name:<12} {elapsed:>10.4f}' + (' OVER BUDGET' if over else ''))
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
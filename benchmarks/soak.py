@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+
+# soak.py
+#
+# Copyright 2022 Fyodor Sobolev
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE X CONSORTIUM BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# Except as contained in this notice, the name(s) of the above copyright
+# holders shall not be used in advertising or otherwise to promote the sale,
+# use or other dealings in this Software without prior written
+# authorization.
+#
+# SPDX-License-Identifier: MIT
+
+# Restarts cava many times and checks that threads, file descriptors,
+# redraw timers, memory and CPU usage stay the same. Needs cava and
+# installed GSettings schema. Usage:
+#
+#   python3 benchmarks/soak.py [--cycles N] [--gtk]
+#
+# With --gtk a window with the drawing area is shown too (needs display),
+# and the number of redraws per second is checked after every restart.
+
+import os
+import sys
+import time
+import argparse
+import threading
+from common import load_cavalier
+
+load_cavalier()
+from cavalier.cava import Cava
+
+def count_fds():
+    return len(os.listdir('/proc/self/fd'))
+
+def rss_kb():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+
+def cpu_time():
+    times = os.times()
+    return times.user + times.system
+
+def wait_running(cava, iterate=None, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while cava.state != 'running' or len(cava.sample) == 0:
+        if time.monotonic() > deadline:
+            raise RuntimeError(f'cava is {cava.state} after {timeout} s')
+        if iterate:
+            iterate(0.01)
+        else:
+            time.sleep(0.01)
+
+class Soak:
+    def __init__(self, cycles, gtk):
+        self.cycles = cycles
+        self.gtk = gtk
+        self.failed = False
+        self.redraws = 0
+
+    def check(self, name, value, expected):
+        ok = value == expected
+        self.failed = self.failed or not ok
+        print(f'  {name}: {value} (expected {expected}) - ' + \
+            ('ok' if ok else 'FAIL'))
+
+    def iterate(self, seconds):
+        if not self.gtk:
+            time.sleep(seconds)
+            return
+        from gi.repository import GLib
+        deadline = time.monotonic() + seconds
+        context = GLib.MainContext.default()
+        while time.monotonic() < deadline:
+            context.iteration(False)
+            time.sleep(0.001)
+
+    def cpu_rate(self):
+        # CPU seconds used per second of steady running
+        start = cpu_time()
+        self.iterate(1.0)
+        return cpu_time() - start
+
+    def redraw_rate(self):
+        start = self.redraws
+        self.iterate(1.0)
+        return self.redraws - start
+
+    def run(self):
+        if self.gtk:
+            import gi
+            gi.require_version('Gtk', '4.0')
+            from gi.repository import Gtk
+            from cavalier.drawing_area import CavalierDrawingArea
+            # Count redraws instead of timers, as GLib can't list them
+            redraw = CavalierDrawingArea.redraw
+            def counting_redraw(area):
+                self.redraws += 1
+                return redraw(area)
+            CavalierDrawingArea.redraw = counting_redraw
+            window = Gtk.Window.new()
+            area = CavalierDrawingArea.new()
+            window.set_child(area)
+            window.present()
+            area.run()
+            cava = area.cava
+        else:
+            cava = Cava()
+            cava.start()
+
+        wait_running(cava, self.iterate)
+        threads = threading.active_count()
+        fds = count_fds()
+        rss = rss_kb()
+        rate = self.redraw_rate() if self.gtk else 0
+        load = self.cpu_rate()
+        cpu = cpu_time()
+
+        for i in range(self.cycles):
+            if i % 2 == 0:
+                cava.restart()
+            else:
+                cava.stop()
+                cava.start()
+            if self.gtk:
+                # The paths that used to add a redraw timer every time
+                area.run()
+            wait_running(cava, self.iterate)
+
+        self.iterate(0.5)
+        print(f'After {self.cycles} restarts ({cava.restarts} counted):')
+        self.check('threads', threading.active_count(), threads)
+        self.check('file descriptors', count_fds(), fds)
+        if self.gtk:
+            # A few frames of jitter are fine, twice as many is not
+            new_rate = self.redraw_rate()
+            self.check('redraw rate within 20%', \
+                abs(new_rate - rate) <= rate * 0.2, True)
+        growth = rss_kb() - rss
+        self.check('memory growth under 5 MB', growth < 5 * 1024, True)
+        print(f'  memory growth: {growth} kB')
+        print(f'  CPU time per restart: ' \
+            f'{(cpu_time() - cpu) * 1000 / self.cycles:.1f} ms')
+        new_load = self.cpu_rate()
+        self.check('steady CPU usage within 20 ms/s', \
+            new_load - load <= 0.02, True)
+        print(f'  steady CPU usage: {load * 100:.1f}% before, ' \
+            f'{new_load * 100:.1f}% after')
+
+        if self.gtk:
+            area.stop()
+        else:
+            cava.stop()
+        return 1 if self.failed else 0
+
+def main():
+    parser = argparse.ArgumentParser(description='Cava restarts soak test')
+    parser.add_argument('--cycles', type=int, default=300)
+    parser.add_argument('--gtk', action='store_true')
+    args = parser.parse_args()
+    return Soak(args.cycles, args.gtk).run()
+
+if __name__ == '__main__':
+    sys.exit(main())
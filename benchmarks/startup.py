@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+
+# startup.py
+#
+# Copyright 2022 Fyodor Sobolev
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE X CONSORTIUM BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# Except as contained in this notice, the name(s) of the above copyright
+# holders shall not be used in advertising or otherwise to promote the sale,
+# use or other dealings in this Software without prior written
+# authorization.
+#
+# SPDX-License-Identifier: MIT
+
+# Measures how long Cavalier takes to show its window and to draw the first
+# frame with audio data. Usage:
+#
+#   python3 benchmarks/startup.py [--runs N] [command...]
+#
+# The command defaults to `cavalier`. The app reports CLOCK_MONOTONIC
+# timestamps when CAVALIER_STARTUP_BENCHMARK is set and quits after
+# the first frame.
+
+import os
+import sys
+import time
+import argparse
+import statistics
+import subprocess
+
+def measure(command):
+    env = dict(os.environ, CAVALIER_STARTUP_BENCHMARK='1')
+    start = time.monotonic()
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, env=env, \
+        text=True)
+    result = {}
+    for line in process.stdout:
+        if line.startswith('startup: '):
+            (name, stamp) = line.split()[1:3]
+            result[name] = float(stamp) - start
+    process.wait()
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description='Cavalier startup benchmark')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('command', nargs='*', default=['cavalier'])
+    args = parser.parse_args()
+
+    results = {'window': [], 'first-frame': []}
+    for i in range(args.runs):
+        run = measure(args.command)
+        for name in results:
+            if name in run:
+                results[name].append(run[name])
+    for (name, values) in results.items():
+        if len(values) == 0:
+            print(f'time-to-{name}: no data')
+            continue
+        print(f'time-to-{name}: median {statistics.median(values) * 1000:.1f} ms, ' \
+            f'min {min(values) * 1000:.1f} ms, max {max(values) * 1000:.1f} ms ' \
+            f'({len(values)} runs)')
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -29,84 +29,409 @@
 # SPDX-License-Identifier: MIT
 
 import os
+import re
+import time
+import select
 import subprocess
-import struct
+import tempfile
+import hashlib
+from array import array
+from functools import lru_cache
+from threading import Thread, Event, current_thread
 from cavalier.settings import CavalierSettings
+from cavalier.ring_buffer import RingBufferWriter, default_path
+from cavalier.post_processing import PostProcessor
+from cavalier.profiling import instrument
+
+# All capture methods Cavalier knows about
+INPUT_METHODS = ('pipewire', 'pulse', 'alsa', 'fifo')
+# First CAVA release with PipeWire input
+PIPEWIRE_VERSION = (0, 9)
+
+@lru_cache(maxsize=1)
+def get_cava_version():
+    # Returns (major, minor) of installed cava, or None if it's unknown
+    try:
+        output = subprocess.run(['cava', '-v'], capture_output=True, \
+            text=True, timeout=5).stdout
+    except (OSError, subprocess.SubprocessError):
+        return None
+    match = re.search(r'(\d+)\.(\d+)', output)
+    if match == None:
+        return None
+    return (int(match.group(1)), int(match.group(2)))
+
+def get_input_methods():
+    # Capture methods supported by installed cava
+    version = get_cava_version()
+    if version == None or version < PIPEWIRE_VERSION:
+        return tuple(m for m in INPUT_METHODS if m != 'pipewire')
+    return INPUT_METHODS
 
 class Cava:
+    # Cava is considered stalled after this many frame periods without data
+    STALL_FRAMES = 120
+    # Delays between restarts of crashed or stalled cava (in seconds)
+    BACKOFF_MIN = 0.5
+    BACKOFF_MAX = 30.0
+    # Sample rate used by cava for PipeWire and FIFO input
+    SAMPLE_RATE = 44100
+    # Cava running for this long resets the backoff (in seconds)
+    STABLE_TIME = 10.0
+
     def __init__(self):
         self.BYTETYPE = "H"
         self.BYTESIZE = 2
         self.BYTENORM = 65535
-        self.restarting = False
+        self.framerate = 60
 
         self.settings = CavalierSettings.new()
+        # Values used instead of settings, e.g. from command line
+        self.overrides = {}
 
         self.sample = []
+        # Peak caps for the current sample, empty if they are disabled
+        self.peaks = []
+        self.processor = PostProcessor()
+        self.fingerprint = None
+        self.thread = None
+        self.process = None
+        self.stopping = Event()
+        # Set by restart() and stop() to cut the backoff delay short
+        self.wake = Event()
+        self.restart_requested = False
+        # Objects with `publish(data, bars)` method that receive every frame
+        self.sinks = []
+        self.publisher = None
+        # Publishers removed from sinks, closed by the reader thread when
+        # it can't be using them anymore
+        self.retired = []
+
+        # One of 'stopped', 'starting', 'running', 'stalled', 'restarting'
+        self.state = 'stopped'
+        self.restarts = 0
+        self.crashes = 0
+        self.stalls = 0
+        self.short_reads = 0
+        self.misaligned = 0
 
         if os.getenv('XDG_CONFIG_HOME'):
             self.config_dir = os.getenv('XDG_CONFIG_HOME') + '/cavalier'
         else:
             self.config_dir = os.getenv('HOME') + '/.config/cavalier'
-        if not os.path.isdir(self.config_dir):
-            os.makedirs(self.config_dir)
         self.config_file_path = self.config_dir + '/config'
 
+    def start(self):
+        if self.is_running():
+            return
+        self.stopping.clear()
+        self.thread = Thread(target=self.run)
+        self.thread.start()
+
+    def is_running(self):
+        return self.thread != None and self.thread.is_alive()
+
+    @instrument
     def run(self):
-        self.load_settings()
-        self.write_config()
-        self.process = subprocess.Popen(["cava", "-p", self.config_file_path], \
-            stdout=subprocess.PIPE)
-        source = self.process.stdout
-        self.restarting = False
-        self.chunk = self.BYTESIZE * self.bars
-        self.fmt = self.BYTETYPE * self.bars
-        while True:
-            data = source.read(self.chunk)
-            if len(data) < self.chunk or self.restarting:
+        # Supervise cava: start it, read its output and start it again
+        # with exponential backoff if it exits, stalls or breaks the stream
+        failures = 0
+        self.update_publisher()
+        self.update_processor()
+        while not self.stopping.is_set():
+            self.state = 'starting'
+            self.restart_requested = False
+            self.wake.clear()
+            self.load_settings()
+            config = self.get_config()
+            self.fingerprint = self.get_fingerprint(config)
+            started = time.monotonic()
+            try:
+                self.process = self.spawn(config)
+            except OSError as e:
+                print("Can't start cava...")
+                print(e)
+                self.process = None
+            if self.process != None:
+                # stop() could be called while cava was starting
+                if not self.stopping.is_set():
+                    self.read(self.process)
+                self.reap(self.process)
+            self.sample = []
+            self.close_retired()
+            if self.stopping.is_set():
                 break
-            self.sample = \
-                [i / self.BYTENORM for i in struct.unpack(self.fmt, data)]
+            self.state = 'restarting'
+            self.restarts += 1
+            if self.restart_requested:
+                continue
+            if time.monotonic() - started >= self.STABLE_TIME:
+                failures = 0
+            delay = min(self.BACKOFF_MIN * 2 ** failures, self.BACKOFF_MAX)
+            failures += 1
+            self.wake.wait(delay)
+            if self.restart_requested:
+                # Settings have changed, so previous failures don't count
+                failures = 0
+        if self.publisher != None:
+            # Readers of the ring buffer see that the writer is gone
+            self.retire_publisher()
+        self.close_retired()
+        self.state = 'stopped'
+
+    def read(self, process):
+        fd = process.stdout.fileno()
+        bars = self.bars
+        chunk = self.BYTESIZE * bars
+        timeout = round(self.STALL_FRAMES * 1000 / self.framerate)
+        poller = select.poll()
+        poller.register(fd, select.POLLIN)
+        # Buffers are allocated once per cava process, so reading frames
+        # doesn't create new objects and doesn't trigger garbage collection
+        buf = bytearray(chunk * 64)
+        view = memoryview(buf)
+        frame = bytearray(chunk)
+        values = memoryview(frame).cast(self.BYTETYPE)
+        # Samples are filled in turns, so the one being drawn right now
+        # is not overwritten
+        samples = [array('d', bytes(8 * bars)) for i in range(3)]
+        peaks = [array('d', bytes(8 * bars)) for i in range(3)]
+        processor = self.processor
+        processor.framerate = self.framerate
+        processor.reset(bars)
+        norm = 1 / self.BYTENORM
+        filled = 0
+        counter = 0
+        while True:
+            ready = poller.poll(timeout)
+            if self.stopping.is_set() or self.restart_requested:
+                return
+            if not ready:
+                self.stalls += 1
+                self.state = 'stalled'
+                self.sample = []
+                if filled > 0:
+                    # Cava writes every frame at once, so a partial frame
+                    # left after a pause means the stream lost alignment
+                    self.misaligned += 1
+                process.kill()
+                return
+            count = os.readv(fd, (view[filled:],))
+            if count == 0:
+                if filled > 0:
+                    self.short_reads += 1
+                self.crashes += 1
+                return
+            filled += count
+            self.state = 'running'
+            frames = filled // chunk
+            if frames > 0:
+                # Only the latest complete frame is interesting
+                end = frames * chunk
+                frame[:] = view[end - chunk:end]
+                sample = samples[counter % 3]
+                sample_peaks = peaks[counter % 3]
+                counter += 1
+                if processor.process(values, norm, sample, sample_peaks):
+                    self.peaks = sample_peaks
+                else:
+                    self.peaks = []
+                self.sample = sample
+                for sink in self.sinks:
+                    sink.publish(frame, bars)
+                if len(self.retired) > 0:
+                    self.close_retired()
+                view[:filled - end] = view[end:filled]
+                filled -= end
 
-    def stop(self):
-        if not self.restarting:
+    def reap(self, process):
+        if process.poll() == None:
+            process.kill()
+        process.wait()
+        process.stdout.close()
+
+    def restart(self):
+        self.restart_requested = True
+        self.wake.set()
+        self.sample = []
+        if self.process != None:
             self.process.kill()
 
+    def stop(self, timeout=5.0):
+        self.stopping.set()
+        self.wake.set()
+        if self.process != None:
+            self.process.kill()
+        # Wait for the reader thread, so threads never pile up
+        # when cava is stopped and started again
+        if self.thread != None and self.thread != current_thread():
+            self.thread.join(timeout)
+
+    def update_publisher(self):
+        # Share frames with other programs through memory-mapped file
+        path = None
+        if self.get_setting('publish-frames'):
+            # Empty path means the default per-user file
+            path = self.get_setting('publish-path') or default_path()
+        if self.publisher != None and self.publisher.path != path:
+            self.retire_publisher()
+        if path and self.publisher == None:
+            try:
+                self.publisher = RingBufferWriter(path, self.framerate)
+                self.sinks = self.sinks + [self.publisher]
+            except OSError as e:
+                print("Can't publish frames to " + path)
+                print(e)
+
+    def retire_publisher(self):
+        # The reader thread may be still using the publisher, so it's
+        # closed later by close_retired()
+        self.sinks = [s for s in self.sinks if s != self.publisher]
+        self.retired.append(self.publisher)
+        self.publisher = None
+
+    def close_retired(self):
+        # Only called from the reader thread, after it's done with sinks
+        while len(self.retired) > 0:
+            self.retired.pop().close()
+
+    def update_processor(self):
+        # Post-processing parameters are applied from the next frame
+        processor = self.processor
+        processor.gain = self.get_setting('gain')
+        processor.gravity = self.get_setting('gravity')
+        processor.peak_caps = self.get_setting('peak-caps')
+        processor.amplitude_scale = self.get_setting('amplitude-scale')
+        processor.smoothing = self.get_setting('frame-smoothing')
+
+    def get_stats(self):
+        return {
+            'state': self.state,
+            'restarts': self.restarts,
+            'crashes': self.crashes,
+            'stalls': self.stalls,
+            'short_reads': self.short_reads,
+            'misaligned': self.misaligned
+        }
+
+    def get_setting(self, key):
+        if key in self.overrides:
+            return self.overrides[key]
+        return self.settings.get(key)
+
     def load_settings(self):
         # Cava config options
-        self.bars = self.settings.get('bars')
-        self.autosens = int(self.settings.get('autosens'))
-        self.sensitivity = self.settings.get('sensitivity')
-        self.channels = self.settings.get('channels')
-        if self.settings.get('smoothing') == 'off':
+        self.bars = self.get_setting('bars')
+        self.autosens = int(self.get_setting('autosens'))
+        self.sensitivity = self.get_setting('sensitivity')
+        self.channels = self.get_setting('channels')
+        if self.get_setting('smoothing') == 'off':
             self.monstercat = 0
         else:
             self.monstercat = 1
-        self.noise_reduction = self.settings.get('noise-reduction')
+        self.noise_reduction = self.get_setting('noise-reduction')
+        self.input_method = self.get_setting('input-method')
+        # Version of cava is only checked when it matters, as running it
+        # slows down startup
+        if self.input_method == 'pipewire' and \
+                self.input_method not in get_input_methods():
+            # Cava would exit on every start with unsupported method
+            print(f'Cava doesn\'t support "{self.input_method}" input, ' \
+                'using "pulse" instead')
+            self.input_method = 'pulse'
+        self.input_source = self.get_setting('input-source')
+        self.input_buffer = self.get_setting('input-buffer')
+
+    def config_changed(self):
+        # Compare the config cava would get now with the running one, so
+        # settings that end up producing the same config don't restart it
+        self.load_settings()
+        return self.get_fingerprint(self.get_config()) != self.fingerprint
+
+    def get_fingerprint(self, config):
+        # Environment is included, as it holds the capture buffer size
+        env = repr(sorted(self.get_environment().items()))
+        return hashlib.sha1((config + env).encode()).hexdigest()
+
+    def get_environment(self):
+        # Capture buffer size is not a cava option, but PulseAudio and
+        # PipeWire client libraries take the requested latency from here
+        env = {}
+        if self.input_buffer > 0:
+            if self.input_method == 'pulse':
+                env['PULSE_LATENCY_MSEC'] = str(self.input_buffer)
+            elif self.input_method == 'pipewire':
+                env['PIPEWIRE_LATENCY'] = \
+                    f'{self.input_buffer * self.SAMPLE_RATE // 1000}/' \
+                    f'{self.SAMPLE_RATE}'
+        return env
+
+    def spawn(self, config):
+        # Pass the config through an anonymous in-memory file when possible,
+        # so starting cava doesn't depend on the config directory at all
+        env = self.get_environment()
+        env = dict(os.environ, **env) if len(env) > 0 else None
+        fd = None
+        if hasattr(os, 'memfd_create'):
+            try:
+                fd = os.memfd_create('cavalier-config')
+                os.write(fd, config.encode())
+            except OSError as e:
+                print("Can't pass config to cava in memory, using file...")
+                print(e)
+                if fd != None:
+                    os.close(fd)
+                fd = None
+        if fd != None:
+            try:
+                return subprocess.Popen( \
+                    ["cava", "-p", f'/proc/self/fd/{fd}'], \
+                    stdout=subprocess.PIPE, pass_fds=(fd,), env=env)
+            finally:
+                os.close(fd)
+        self.write_config(config)
+        return subprocess.Popen(["cava", "-p", self.config_file_path], \
+            stdout=subprocess.PIPE, env=env)
+
+    def get_config(self):
+        input_config = [f'method = {self.input_method}']
+        if self.input_source not in ('', 'auto'):
+            input_config.append(f'source = {self.input_source}')
+        if self.input_method == 'fifo':
+            input_config += [f'sample_rate = {self.SAMPLE_RATE}', \
+                'sample_bits = 16']
+        return '\n'.join([
+            '[general]',
+            f'bars = {self.bars}',
+            f'autosens = {self.autosens}',
+            f'sensitivity = {self.sensitivity ** 2}',
+            f'framerate = {self.framerate}',
+            # Keep writing frames in silence, otherwise it looks like a stall
+            'sleep_timer = 0',
+            '[input]',
+            *input_config,
+            '[output]',
+            f'channels = {self.channels}',
+            'mono_option = average',
+            'method = raw',
+            'raw_target = /dev/stdout',
+            'bit_format = 16bit',
+            '[smoothing]',
+            f'monstercat = {self.monstercat}',
+            f'noise_reduction = {self.noise_reduction}'
+        ])
 
-    def write_config(self):
+    def write_config(self, config):
+        # Write to a temporary file and rename it, so cava never reads
+        # a partially written config
         try:
-            f = open(self.config_file_path, 'w')
-            conf = '\n'.join([
-                '[general]',
-                f'bars = {self.bars}',
-                f'autosens = {self.autosens}',
-                f'sensitivity = {self.sensitivity ** 2}',
-                'framerate = 60',
-                '[input]',
-                'method = pulse',
-                '[output]',
-                f'channels = {self.channels}',
-                'mono_option = average',
-                'method = raw',
-                'raw_target = /dev/stdout',
-                'bit_format = 16bit',
-                '[smoothing]',
-                f'monstercat = {self.monstercat}',
-                f'noise_reduction = {self.noise_reduction}'
-            ])
-            f.write(conf)
-            f.close()
+            if not os.path.isdir(self.config_dir):
+                os.makedirs(self.config_dir)
+            (fd, tmp_path) = tempfile.mkstemp(dir=self.config_dir, \
+                prefix='.config-')
+            with os.fdopen(fd, 'w') as f:
+                f.write(config)
+            os.replace(tmp_path, self.config_file_path)
         except Exception as e:
             print("Can't write config file for cava...'")
             print(e)
@@ -28,38 +28,123 @@
 #
 # SPDX-License-Identifier: MIT
 
-import os
 import cairo
+import math
+import struct
+from array import array
+from functools import lru_cache
+from threading import get_ident, Lock
+
+# Height of peak caps in "bars" mode (in pixels)
+PEAK_CAP = 3
+
+@lru_cache(maxsize=4)
+def get_gradient(height, colors):
+    pat = cairo.LinearGradient(0.0, 0.0, 0.0, height)
+    for i in range(len(colors)):
+        (red, green, blue, alpha) = colors[i]
+        pat.add_color_stop_rgba(1 / (len(colors) - 1) * i, \
+            red / 255, green / 255, blue / 255, alpha)
+    return pat
 
 def set_source(cr, height, colors):
     if len(colors) > 1:
-        pat = cairo.LinearGradient(0.0, 0.0, 0.0, height)
-        for i in range(len(colors)):
-            (red, green, blue, alpha) = colors[i]
-            pat.add_color_stop_rgba(1 / (len(colors) - 1) * i, \
-                red / 255, green / 255, blue / 255, alpha)
-        cr.set_source(pat)
+        # Gradient is only created again when height or colors change
+        cr.set_source(get_gradient(height, tuple(colors)))
     else:
         (red, green, blue, alpha) = colors[0]
         cr.set_source_rgba(red / 255, green / 255, blue / 255, alpha)
 
-def wave(sample, cr, width, height, colors):
+@lru_cache(maxsize=8)
+def wave_points_x(width, ls):
+    # X positions of points and horizontal offsets of Bézier control points
+    # don't depend on sample, so they are only calculated on resize
+    step = width / (ls - 1)
+    return ([step * i for i in range(ls)], step * 0.5, step / 3)
+
+@lru_cache(maxsize=4)
+def wave_buffers(ls, thread):
+    # Lists for y positions, spline tangents and slopes, reused every frame.
+    # Each thread gets its own lists, as frames may be drawn in a render
+    # thread and for recording at the same time
+    return ([0.0] * ls, [0.0] * ls, [0.0] * (ls - 1))
+
+def spline_tangents(ys, m, d):
+    # Monotone cubic interpolation (Fritsch-Butland): tangent is
+    # the harmonic mean of neighbouring slopes, or 0 at local extremes,
+    # so the curve never overshoots the points
+    ls = len(ys)
+    for i in range(ls - 1):
+        d[i] = ys[i + 1] - ys[i]
+    m[0] = d[0]
+    for i in range(1, ls - 1):
+        if d[i - 1] * d[i] > 0:
+            m[i] = 2 * d[i - 1] * d[i] / (d[i - 1] + d[i])
+        else:
+            m[i] = 0.0
+    m[ls - 1] = d[ls - 2]
+
+def wave(sample, cr, width, height, colors, curve='bezier'):
     set_source(cr, height, colors)
     ls = len(sample)
-    cr.move_to(0, (1.0 - sample[0]) * height)
-    for i in range(ls - 1):
-        height_diff = (sample[i] - sample[i+1])
-        cr.rel_curve_to(width / (ls - 1) * 0.5, 0.0, \
-           width / (ls - 1) * 0.5, height_diff * height, \
-           width / (ls - 1), height_diff * height)
+    (xs, bezier_dx, spline_dx) = wave_points_x(width, ls)
+    (ys, m, d) = wave_buffers(ls, get_ident())
+    for i in range(ls):
+        ys[i] = (1.0 - sample[i]) * height
+    cr.move_to(0, ys[0])
+    if curve == 'spline':
+        spline_tangents(ys, m, d)
+        for i in range(1, ls):
+            cr.curve_to(xs[i - 1] + spline_dx, ys[i - 1] + m[i - 1] / 3, \
+                xs[i] - spline_dx, ys[i] - m[i] / 3, xs[i], ys[i])
+    else:
+        for i in range(1, ls):
+            cr.curve_to(xs[i - 1] + bezier_dx, ys[i - 1], \
+                xs[i] - bezier_dx, ys[i], xs[i], ys[i])
     cr.line_to(width, height)
     cr.line_to(0, height)
     cr.close_path()
     cr.fill()
 
-def levels(sample, cr, width, height, colors, offset):
+@lru_cache(maxsize=8)
+def snapped_columns(width, ls, offset, scale):
+    # X positions and width of items aligned to device pixels. All items
+    # get the same width and leftover pixels are spread across the gaps.
+    device_width = round(width * scale)
+    step = device_width / ls
+    item_width = max(int(step - round(step * offset / 100) * 2), 1)
+    return [(round(step * i + (step - item_width) / 2) / scale, \
+        item_width / scale) for i in range(ls)]
+
+@lru_cache(maxsize=8)
+def snapped_rows(height, step, offset, scale):
+    # Y positions and height of the 10 levels aligned to device pixels
+    # (from the bottom one), gaps are the same as between columns
+    device_height = round(height * scale)
+    gap = round(step * scale * offset / 100)
+    rows = []
+    for r in range(10):
+        top = round(device_height * (9 - r) / 10) + gap
+        bottom = round(device_height * (10 - r) / 10) - gap
+        rows.append((top / scale, max(bottom - top, 1) / scale))
+    return rows
+
+def levels(sample, cr, width, height, colors, offset, scale=1, snap=False):
     set_source(cr, height, colors)
     ls = len(sample)
+    if snap:
+        columns = snapped_columns(width, ls, offset, scale)
+        rows = snapped_rows(height, width / ls, offset, scale)
+        for i in range(ls):
+            (x, w) = columns[i]
+            for r in range(int(round(sample[i], 1) * 10)):
+                (y, h) = rows[r]
+                cr.rectangle(x, y, w, h)
+        # Edges are on pixel boundaries, antialiasing would only cost time
+        cr.set_antialias(cairo.ANTIALIAS_NONE)
+        cr.fill()
+        cr.set_antialias(cairo.ANTIALIAS_DEFAULT)
+        return
     step = width / ls
     offset_px = step * offset / 100
     for i in range(ls):
@@ -70,12 +155,203 @@ def levels(sample, cr, width, height, colors, offset):
                 step - offset_px * 2, height / 10 - offset_px * 2)
     cr.fill()
 
-def bars(sample, cr, width, height, colors, offset):
+def bars(sample, cr, width, height, colors, offset, scale=1, snap=False, \
+        peaks=()):
     set_source(cr, height, colors)
     ls = len(sample)
+    # Peaks of a different frame size are ignored
+    if len(peaks) != ls:
+        peaks = ()
+    if snap:
+        columns = snapped_columns(width, ls, offset, scale)
+        cap = max(round(PEAK_CAP * scale), 1) / scale
+        for i in range(ls):
+            (x, w) = columns[i]
+            top = round((height - height * sample[i]) * scale) / scale
+            cr.rectangle(x, top, w, height - top)
+            if peaks:
+                top = round((height - height * peaks[i]) * scale) / scale
+                cr.rectangle(x, max(top - cap, 0), w, cap)
+        # Edges are on pixel boundaries, antialiasing would only cost time
+        cr.set_antialias(cairo.ANTIALIAS_NONE)
+        cr.fill()
+        cr.set_antialias(cairo.ANTIALIAS_DEFAULT)
+        return
     step = width / ls
     offset_px = step * offset / 100
     for i in range(ls):
         cr.rectangle(step * i + offset_px, height - height * sample[i], \
             step - offset_px * 2, height)
+        if peaks:
+            cr.rectangle(step * i + offset_px, \
+                max(height - height * peaks[i] - PEAK_CAP, 0), \
+                step - offset_px * 2, PEAK_CAP)
     cr.fill()
+
+class FrameCache:
+    """Last frame of "levels" or "bars" mode kept in an image.
+
+    Every new frame is compared with the previous one in device pixels,
+    column by column. Only columns that changed are cleared and drawn again,
+    the rest of the image is left as it was. Frames without visible changes
+    are not drawn at all.
+    """
+    def __init__(self):
+        self.surface = None
+        self.cr = None
+        self.key = None
+        # Bar tops (or lit levels) of the last frame, followed by peak caps
+        self.heights = array('i')
+
+    def update(self, mode, sample, width, height, colors, offset, scale, \
+            snap, peaks=()):
+        # Returns True if the image has changed and has to be painted again
+        ls = len(sample)
+        if mode != 'bars' or len(peaks) != ls:
+            peaks = ()
+        key = (mode, width, height, scale, colors, offset, snap, ls, \
+            len(peaks))
+        if key != self.key:
+            # Everything is drawn again after any change of size or style
+            if self.key == None or self.key[1:4] != key[1:4]:
+                self.surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, \
+                    round(width * scale), round(height * scale))
+                self.surface.set_device_scale(scale, scale)
+                self.cr = cairo.Context(self.surface)
+            self.key = key
+            # No real height is negative, so every column is changed
+            self.heights = array('i', [-1]) * (ls + len(peaks))
+            if ls == 0:
+                self.draw(self.cr, mode, sample, width, height, colors, \
+                    offset, scale, snap, peaks)
+                return True
+        if ls == 0:
+            return False
+        heights = self.heights
+        levels_mode = mode == 'levels'
+        has_peaks = len(peaks) > 0
+        step = round(width * scale) / ls
+        cr = self.cr
+        # Changed columns are found in the same pass that stores the new
+        # heights. Runs of neighbouring columns are added to the clip as
+        # one rectangle, rounded out to device pixels.
+        first = -1
+        damaged = False
+        for i in range(ls + 1):
+            changed = False
+            if i < ls:
+                if levels_mode:
+                    h = int(round(sample[i], 1) * 10)
+                else:
+                    h = round((height - height * sample[i]) * scale)
+                if h != heights[i]:
+                    heights[i] = h
+                    changed = True
+                if has_peaks:
+                    h = round((height - height * peaks[i]) * scale)
+                    if h != heights[ls + i]:
+                        heights[ls + i] = h
+                        changed = True
+            if changed:
+                if first < 0:
+                    first = i
+            elif first >= 0:
+                x = math.floor(step * first)
+                cr.rectangle(x / scale, 0, \
+                    (math.ceil(step * i) - x) / scale, height)
+                first = -1
+                damaged = True
+        if not damaged:
+            return False
+        cr.save()
+        cr.clip()
+        self.draw(cr, mode, sample, width, height, colors, offset, scale, \
+            snap, peaks)
+        cr.restore()
+        return True
+
+    def draw(self, cr, mode, sample, width, height, colors, offset, scale, \
+            snap, peaks):
+        # Only clipped area is cleared and filled
+        cr.set_operator(cairo.OPERATOR_CLEAR)
+        cr.paint()
+        cr.set_operator(cairo.OPERATOR_OVER)
+        if len(sample) == 0:
+            return
+        if mode == 'levels':
+            levels(sample, cr, width, height, colors, offset, scale, snap)
+        else:
+            bars(sample, cr, width, height, colors, offset, scale, snap, \
+                peaks)
+
+    def paint(self, cr):
+        if self.surface != None:
+            cr.set_source_surface(self.surface, 0, 0)
+            cr.paint()
+
+class Spectrogram:
+    """History of samples kept in a circular image.
+
+    Every new sample is written as one column of pixels at the current
+    position, which then moves right and wraps around. Drawing composes
+    the image from two parts split at that position, so the cost of a frame
+    doesn't depend on the length of history.
+    """
+    HISTORY = 256
+
+    def __init__(self, bars, colors):
+        self.bars = bars
+        self.surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, \
+            self.HISTORY, bars)
+        self.data = self.surface.get_data()
+        self.stride = self.surface.get_stride()
+        self.position = 0
+        self.lock = Lock()
+        self.set_colors(colors)
+
+    def set_colors(self, colors):
+        # Lookup table of 256 premultiplied pixels: the highest value gets
+        # the first (top) color of gradient, the lowest gets the last one.
+        # Single color fades out to transparent instead.
+        lut = []
+        for i in range(256):
+            v = i / 255
+            if len(colors) > 1:
+                t = (1.0 - v) * (len(colors) - 1)
+                index = min(int(t), len(colors) - 2)
+                f = t - index
+                (r, g, b, a) = [c1 + (c2 - c1) * f for (c1, c2) in \
+                    zip(colors[index], colors[index + 1])]
+            else:
+                (r, g, b, a) = colors[0]
+                a *= v
+            lut.append(struct.pack('=I', (round(a * 255) << 24) | \
+                (round(r * a) << 16) | (round(g * a) << 8) | round(b * a)))
+        self.lut = lut
+
+    def push(self, sample):
+        with self.lock:
+            self.surface.flush()
+            x = self.position * 4
+            for i in range(self.bars):
+                value = min(max(int(sample[i] * 255), 0), 255)
+                offset = (self.bars - 1 - i) * self.stride + x
+                self.data[offset:offset + 4] = self.lut[value]
+            self.surface.mark_dirty_rectangle(self.position, 0, 1, self.bars)
+            self.position = (self.position + 1) % self.HISTORY
+
+def spectrogram(history, cr, width, height):
+    with history.lock:
+        cr.save()
+        cr.scale(width / history.HISTORY, height / history.bars)
+        # Oldest columns are to the right of the current position
+        split = history.HISTORY - history.position
+        for (x, source_x, w) in ((0, history.position, split), \
+                (split, 0, history.position)):
+            if w == 0:
+                continue
+            cr.set_source_surface(history.surface, x - source_x, 0)
+            cr.get_source().set_filter(cairo.FILTER_NEAREST)
+            cr.rectangle(x, 0, w, history.bars)
+            cr.fill()
+        cr.restore()
@@ -29,10 +29,13 @@
 # SPDX-License-Identifier: MIT
 
 from gi.repository import Gtk, GObject
-from threading import Thread
 from cavalier.cava import Cava
-from cavalier.draw_functions import wave, levels, bars
+from cavalier.draw_functions import wave, levels, bars, spectrogram, \
+    Spectrogram, FrameCache
 from cavalier.settings import CavalierSettings
+from cavalier.profiling import instrument
+from cavalier.recorder import Recorder
+from cavalier.render_worker import RenderWorker
 
 class CavalierDrawingArea(Gtk.DrawingArea):
     __gtype_name__ = 'CavalierDrawingArea'
@@ -40,14 +43,26 @@ class CavalierDrawingArea(Gtk.DrawingArea):
     def __init__(self, settings, **kwargs):
         super().__init__(**kwargs)
 
-    def new():
+    def new(cava=None):
         cda = Gtk.DrawingArea.new()
         cda.__class__ = CavalierDrawingArea
         cda.set_vexpand(True)
         cda.set_hexpand(True)
         cda.set_draw_func(cda.draw_func, None, None)
-        cda.cava = None
+        cda.cava = cava
+        cda.cava_restart_id = None
+        cda.cava_sample = []
+        cda.cava_peaks = []
+        cda.redraw_id = None
         cda.spinner = None
+        cda.cava_state = None
+        cda.recorder = None
+        cda.render_worker = None
+        cda.last_request = None
+        cda.spectrogram = None
+        cda.frame_cache = FrameCache()
+        cda.scale_factor = cda.get_scale_factor()
+        cda.tick_id = None
         cda.settings = CavalierSettings.new(cda.on_settings_changed)
         cda.connect('unrealize', cda.on_unrealize)
         return cda
@@ -56,48 +71,207 @@ class CavalierDrawingArea(Gtk.DrawingArea):
         self.on_settings_changed(None)
         if self.cava == None:
             self.cava = Cava()
-        self.cava_thread = Thread(target=self.cava.run)
-        self.cava_thread.start()
-        if self.spinner != None:
-            self.spinner.set_visible(False)
-        GObject.timeout_add(1000.0 / 60.0, self.redraw)
+        # Cava may be already started by the application
+        if not self.cava.is_running():
+            self.cava.start()
+        # Only one redraw timer may exist, otherwise frames are queued
+        # several times per tick
+        if self.redraw_id == None:
+            self.redraw_id = GObject.timeout_add(1000.0 / 60.0, self.redraw)
 
+    def stop(self):
+        if self.redraw_id != None:
+            GObject.source_remove(self.redraw_id)
+            self.redraw_id = None
+        if self.cava_restart_id != None:
+            GObject.source_remove(self.cava_restart_id)
+            self.cava_restart_id = None
+        self.stop_recording()
+        self.set_threaded_rendering(False)
+        if self.cava != None:
+            self.cava.stop()
+        self.cava_sample = []
+        self.cava_peaks = []
+        self.frame_cache = FrameCache()
+
+    def set_threaded_rendering(self, enabled):
+        if enabled and self.render_worker == None:
+            self.render_worker = RenderWorker(self.draw_sample)
+            self.tick_id = self.add_tick_callback(self.on_tick)
+        elif not enabled and self.render_worker != None:
+            self.remove_tick_callback(self.tick_id)
+            self.tick_id = None
+            self.render_worker.stop()
+            self.render_worker = None
+
+    def on_tick(self, widget, frame_clock):
+        # Finished frame is shown and the next one is requested on every
+        # frame clock tick, so the worker is never more than a frame ahead
+        if self.render_worker.swap():
+            self.queue_draw()
+        # A new frame is only needed if the sample, size or scale changed
+        (width, height, scale) = (self.get_width(), self.get_height(), \
+            self.get_scale_factor())
+        last = self.last_request
+        if last == None or last[0] is not self.cava_sample or \
+                last[1:] != (width, height, scale):
+            self.last_request = (self.cava_sample, width, height, scale)
+            self.render_worker.request_frame(width, height, scale)
+        return True
+
+    @instrument
     def on_settings_changed(self, key):
-        self.draw_mode = self.settings.get('mode')
-        self.set_margin_top(self.settings.get('margin'))
-        self.set_margin_bottom(self.settings.get('margin'))
-        self.set_margin_start(self.settings.get('margin'))
-        self.set_margin_end(self.settings.get('margin'))
-        self.offset = self.settings.get('items-offset')
-        self.colors = self.settings.get('fg-colors')
-        if len(self.colors) == 0:
-            self.settings.set('fg-colors', [(53, 132, 228, 1.0)])
+        # `key` is None when all settings should be loaded. Any setting may
+        # change how the frame looks, so the worker has to draw it again.
+        self.last_request = None
+        if key in (None, 'mode'):
+            self.draw_mode = self.settings.get('mode')
+        if key in (None, 'wave-curve'):
+            self.wave_curve = self.settings.get('wave-curve')
+        if key in (None, 'margin'):
+            self.set_margin_top(self.settings.get('margin'))
+            self.set_margin_bottom(self.settings.get('margin'))
+            self.set_margin_start(self.settings.get('margin'))
+            self.set_margin_end(self.settings.get('margin'))
+        if key in (None, 'threaded-rendering'):
+            self.set_threaded_rendering( \
+                self.settings.get('threaded-rendering'))
+        if key in (None, 'pixel-snapping'):
+            self.pixel_snapping = self.settings.get('pixel-snapping')
+        if key in (None, 'items-offset'):
+            self.offset = self.settings.get('items-offset')
+        if key in (None, 'fg-colors'):
+            # Tuple can be used as a key for cached gradients
+            self.colors = tuple(self.settings.get('fg-colors'))
+            if len(self.colors) == 0:
+                self.settings.set('fg-colors', [(53, 132, 228, 1.0)])
+            elif self.spectrogram != None:
+                self.spectrogram.set_colors(self.colors)
 
         if key in ('bars', 'autosens', 'sensitivity', 'channels', \
-                'smoothing', 'noise-reduction'):
-            if not self.cava.restarting:
-                self.cava.stop()
-                self.cava.restarting = True
-                if self.spinner != None:
-                    self.spinner.set_visible(True)
-                    self.cava.sample = []
-                GObject.timeout_add_seconds(3, self.run)
+                'smoothing', 'noise-reduction', 'input-method', \
+                'input-source', 'input-buffer'):
+            # Wait until settings stop changing (e.g. while a slider is
+            # dragged) and only then check if cava really needs a restart
+            if self.cava_restart_id != None:
+                GObject.source_remove(self.cava_restart_id)
+            self.cava_restart_id = \
+                GObject.timeout_add_seconds(3, self.restart_cava)
+        elif key in ('publish-frames', 'publish-path'):
+            self.cava.update_publisher()
+        elif key in ('gain', 'gravity', 'peak-caps', 'amplitude-scale', \
+                'frame-smoothing'):
+            self.cava.update_processor()
+
+    def restart_cava(self):
+        self.cava_restart_id = None
+        if self.cava.config_changed():
+            self.cava.restart()
+        return False
+
+    def update_spinner(self):
+        if self.spinner == None:
+            return
+        self.spinner.set_visible(self.cava_state != 'running')
+        states = {
+            'stopped': _('CAVA is stopped'),
+            'starting': _('Starting CAVA…'),
+            'running': _('CAVA is running'),
+            'stalled': _('CAVA stopped responding'),
+            'restarting': _('Restarting CAVA…')
+        }
+        self.spinner.set_tooltip_text(states[self.cava_state] + '\n' + \
+            _('Restarts: {}').format(self.cava.restarts))
 
+    @instrument
     def draw_func(self, area, cr, width, height, data, n):
+        if self.render_worker != None:
+            # The frame is already drawn by the worker, just paint it
+            front = self.render_worker.front
+            if front != None:
+                cr.set_source_surface(front, 0, 0)
+                cr.paint()
+            return
+        if self.draw_mode in ('levels', 'bars'):
+            self.update_frame_cache(width, height)
+            self.frame_cache.paint(cr)
+            return
+        self.draw_sample(cr, width, height)
+
+    def update_frame_cache(self, width, height):
+        # Returns True if the frame looks different from the last one
+        return self.frame_cache.update(self.draw_mode, self.cava_sample, \
+            width, height, self.colors, self.offset, self.scale_factor, \
+            self.pixel_snapping, self.cava_peaks)
+
+    def draw_sample(self, cr, width, height, scale=None):
+        # Scale factor is read on the main thread, as this may be called
+        # from the render worker
+        if scale == None:
+            scale = self.scale_factor
         if len(self.cava_sample) > 0:
             if self.draw_mode == 'wave':
-                wave(self.cava_sample, cr, width, height, self.colors)
+                wave(self.cava_sample, cr, width, height, self.colors, \
+                    self.wave_curve)
             elif self.draw_mode == 'levels':
-                levels(self.cava_sample, cr, width, height, self.colors, self.offset)
+                levels(self.cava_sample, cr, width, height, self.colors, \
+                    self.offset, scale, self.pixel_snapping)
             elif self.draw_mode == 'bars':
-                bars(self.cava_sample, cr, width, height, self.colors, self.offset)
+                bars(self.cava_sample, cr, width, height, self.colors, \
+                    self.offset, scale, self.pixel_snapping, self.cava_peaks)
+            elif self.draw_mode == 'spectrogram':
+                if self.spectrogram != None:
+                    spectrogram(self.spectrogram, cr, width, height)
             else:
                 print(f'Error: Unknown drawing mode "{self.draw_mode}"')
 
+    @instrument
     def redraw(self):
-        self.queue_draw()
+        self.scale_factor = self.get_scale_factor()
+        # Cava fills a different array for every new frame
+        sample_changed = self.cava.sample is not self.cava_sample
+        # Peaks are read first, so they are never newer than the sample
+        self.cava_peaks = self.cava.peaks
         self.cava_sample = self.cava.sample
+        if self.render_worker == None:
+            if self.draw_mode in ('levels', 'bars'):
+                # Only changed columns are drawn, and the widget is not
+                # redrawn at all if nothing visible changed
+                if self.update_frame_cache(self.get_width(), \
+                        self.get_height()):
+                    self.queue_draw()
+            else:
+                self.queue_draw()
+        if self.draw_mode == 'spectrogram':
+            self.update_spectrogram(sample_changed)
+        if self.recorder != None:
+            # Recording surfaces are not scaled
+            self.recorder.record(lambda cr, width, height: \
+                self.draw_sample(cr, width, height, 1))
+        if self.cava.state != self.cava_state:
+            self.cava_state = self.cava.state
+            self.update_spinner()
         return True
 
+    def update_spectrogram(self, sample_changed):
+        sample = self.cava_sample
+        if not sample_changed or len(sample) == 0:
+            return
+        if self.spectrogram == None or self.spectrogram.bars != len(sample):
+            self.spectrogram = Spectrogram(len(sample), self.colors)
+        self.spectrogram.push(sample)
+
+    def start_recording(self, path, background=()):
+        self.recorder = Recorder(path, self.get_width(), self.get_height(), \
+            background=background)
+        return self.recorder
+
+    def stop_recording(self):
+        recorder = self.recorder
+        self.recorder = None
+        if recorder != None:
+            recorder.stop()
+        return recorder
+
     def on_unrealize(self, obj):
-        self.cava.stop()
+        self.stop()
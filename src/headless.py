@@ -0,0 +1,299 @@
+# headless.py
+#
+# Copyright 2022 Fyodor Sobolev
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE X CONSORTIUM BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# Except as contained in this notice, the name(s) of the above copyright
+# holders shall not be used in advertising or otherwise to promote the sale,
+# use or other dealings in this Software without prior written
+# authorization.
+#
+# SPDX-License-Identifier: MIT
+
+# Headless mode: runs only cava and streams its frames, without GTK.
+# Nothing in this module (or modules it imports) may import Gtk or Adw.
+
+import os
+import sys
+import json
+import time
+import signal
+import socket
+import queue
+import math
+import struct
+import argparse
+import tempfile
+import statistics
+from threading import Thread, Timer
+from cavalier.cava import Cava, INPUT_METHODS
+from cavalier import profiling
+
+class StreamSink:
+    def __init__(self, stream, fmt, on_error):
+        self.stream = stream
+        self.fmt = fmt
+        self.on_error = on_error
+        self.seq = 0
+
+    def publish(self, data, bars):
+        self.seq += 1
+        try:
+            if self.fmt == 'binary':
+                self.stream.write(data)
+            else:
+                self.stream.write(encode_json(self.seq, data, bars))
+            self.stream.flush()
+        except (BrokenPipeError, ValueError):
+            self.on_error()
+
+class SocketSink:
+    # Frames are sent to every connected client. Clients that can't keep up
+    # are disconnected, so they never slow down cava reading.
+    def __init__(self, path, fmt):
+        self.path = path
+        self.fmt = fmt
+        self.seq = 0
+        # Only used by the reader thread, new clients are handed over
+        # by the accept thread through a queue
+        self.clients = []
+        self.new_clients = queue.SimpleQueue()
+        if os.path.exists(path):
+            os.unlink(path)
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(path)
+        self.server.listen()
+        Thread(target=self.accept, daemon=True).start()
+
+    def accept(self):
+        while True:
+            try:
+                (client, _) = self.server.accept()
+            except OSError:
+                return
+            client.setblocking(False)
+            self.new_clients.put(client)
+
+    def add_new_clients(self):
+        while not self.new_clients.empty():
+            self.clients.append(self.new_clients.get())
+
+    def publish(self, data, bars):
+        self.seq += 1
+        self.add_new_clients()
+        if len(self.clients) == 0:
+            return
+        if self.fmt == 'binary':
+            message = bytes(data)
+        else:
+            message = encode_json(self.seq, data, bars).encode()
+        for client in self.clients:
+            try:
+                if client.send(message) == len(message):
+                    continue
+            except OSError:
+                pass
+            client.close()
+            self.clients = [c for c in self.clients if c != client]
+
+    def close(self):
+        self.server.close()
+        self.add_new_clients()
+        for client in self.clients:
+            client.close()
+        os.unlink(self.path)
+
+class FifoSignal:
+    # Feeds cava's FIFO input with silence and a short tone every second,
+    # in real time, and remembers when the last tone started
+    CHUNK = 441
+    TONE_CHUNKS = 10
+
+    def __init__(self, path):
+        self.path = path
+        self.tone_time = None
+        self.running = True
+        silence = bytes(self.CHUNK * 4)
+        tone = b''.join(struct.pack('=hh', v, v) for v in \
+            (round(math.sin(2 * math.pi * 1000 * i / Cava.SAMPLE_RATE) \
+            * 26000) for i in range(self.CHUNK)))
+        chunks_per_second = Cava.SAMPLE_RATE // self.CHUNK
+        self.chunks = [tone] * self.TONE_CHUNKS + \
+            [silence] * (chunks_per_second - self.TONE_CHUNKS)
+        Thread(target=self.write, daemon=True).start()
+
+    def write(self):
+        duration = self.CHUNK / Cava.SAMPLE_RATE
+        while self.running:
+            # Opening blocks until cava opens the FIFO, and it's opened
+            # again if cava is restarted
+            with open(self.path, 'wb', buffering=0) as f:
+                start = time.monotonic()
+                counter = 0
+                while self.running:
+                    delay = start + counter * duration - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                    index = counter % len(self.chunks)
+                    if index == 0:
+                        self.tone_time = time.monotonic()
+                    try:
+                        f.write(self.chunks[index])
+                    except BrokenPipeError:
+                        break
+                    counter += 1
+
+class LatencyProbe:
+    # Measures intervals between frames and, with FifoSignal, time from
+    # writing a tone to cava until bars react to it
+    THRESHOLD = 0.3
+
+    def __init__(self, fifo_signal=None):
+        self.fifo_signal = fifo_signal
+        self.intervals = []
+        self.latencies = []
+        self.last_frame = None
+        self.last_tone = None
+
+    def publish(self, data, bars):
+        now = time.monotonic()
+        if self.last_frame != None:
+            self.intervals.append(now - self.last_frame)
+        self.last_frame = now
+        if self.fifo_signal == None:
+            return
+        tone_time = self.fifo_signal.tone_time
+        if tone_time == None or tone_time == self.last_tone:
+            return
+        if max(struct.unpack(f'={bars}H', data)) / 65535 > self.THRESHOLD:
+            self.latencies.append(now - tone_time)
+            self.last_tone = tone_time
+
+    def report(self):
+        lines = []
+        if len(self.intervals) > 1:
+            lines.append(f'frames: {len(self.intervals) + 1}, interval ' \
+                f'{statistics.mean(self.intervals) * 1000:.2f} ms, jitter ' \
+                f'{statistics.stdev(self.intervals) * 1000:.2f} ms')
+        if len(self.latencies) > 0:
+            ms = [l * 1000 for l in self.latencies]
+            lines.append(f'latency: median {statistics.median(ms):.1f} ms, ' \
+                f'min {min(ms):.1f} ms, max {max(ms):.1f} ms ' \
+                f'({len(ms)} tones)')
+        elif self.fifo_signal != None:
+            lines.append('latency: no reaction to test tones')
+        return '\n'.join(lines)
+
+def encode_json(seq, data, bars):
+    values = struct.unpack(f'={bars}H', data)
+    return json.dumps({
+        'seq': seq,
+        'time': time.monotonic(),
+        'bars': [round(v / 65535, 4) for v in values]
+    }, separators=(',', ':')) + '\n'
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog='cavalier --headless', \
+        description='Run CAVA and stream its frames without a window.')
+    parser.add_argument('--headless', action='store_true', \
+        help=argparse.SUPPRESS)
+    parser.add_argument('-f', '--format', choices=['binary', 'json'], \
+        default='json', help='binary: raw 16 bit native values per frame, ' \
+        'json: one JSON object per line (default)')
+    parser.add_argument('-o', '--output', default=None, \
+        help='file to write frames to, "-" for stdout (default, ' \
+        'unless --socket is used)')
+    parser.add_argument('-s', '--socket', default=None, \
+        help='path of Unix socket to stream frames to its clients')
+    parser.add_argument('-b', '--bars', type=int, default=None, \
+        help='number of bars (default from settings)')
+    parser.add_argument('-r', '--framerate', type=int, default=60, \
+        help='frames per second (default 60)')
+    parser.add_argument('-m', '--method', default=None, \
+        choices=INPUT_METHODS, \
+        help='capture method (default from settings)')
+    parser.add_argument('--source', default=None, \
+        help='capture source (default from settings)')
+    parser.add_argument('--measure-latency', type=float, nargs='?', \
+        const=10.0, default=None, metavar='SECONDS', \
+        help='measure frame intervals for SECONDS (default 10) and exit; ' \
+        'with --method fifo and no --source, test tones are fed to cava ' \
+        'to measure its latency')
+    args = parser.parse_args(argv)
+    if args.output == None and args.socket == None and \
+            args.measure_latency == None:
+        args.output = '-'
+    return args
+
+def main(version):
+    args = parse_args(sys.argv[1:])
+    profiling.start()
+    cava = Cava()
+    cava.framerate = args.framerate
+    if args.bars != None:
+        cava.overrides['bars'] = args.bars
+    if args.method != None:
+        cava.overrides['input-method'] = args.method
+    if args.source != None:
+        cava.overrides['input-source'] = args.source
+
+    probe = None
+    fifo_signal = None
+    if args.measure_latency != None:
+        if args.method == 'fifo' and args.source == None:
+            fifo_path = os.path.join(tempfile.mkdtemp(), 'cavalier.fifo')
+            os.mkfifo(fifo_path)
+            cava.overrides['input-source'] = fifo_path
+            fifo_signal = FifoSignal(fifo_path)
+        probe = LatencyProbe(fifo_signal)
+        cava.sinks.append(probe)
+        timer = Timer(args.measure_latency, cava.stop)
+        timer.daemon = True
+        timer.start()
+
+    stream = None
+    if args.output == '-':
+        stream = sys.stdout.buffer if args.format == 'binary' else sys.stdout
+    elif args.output != None:
+        stream = open(args.output, 'wb' if args.format == 'binary' else 'w')
+    if stream != None:
+        cava.sinks.append(StreamSink(stream, args.format, cava.stop))
+    socket_sink = None
+    if args.socket != None:
+        socket_sink = SocketSink(args.socket, args.format)
+        cava.sinks.append(socket_sink)
+
+    signal.signal(signal.SIGINT, lambda *args: cava.stop())
+    signal.signal(signal.SIGTERM, lambda *args: cava.stop())
+    cava.run()
+
+    if fifo_signal != None:
+        fifo_signal.running = False
+        os.unlink(fifo_signal.path)
+        os.rmdir(os.path.dirname(fifo_signal.path))
+    if probe != None:
+        print(probe.report())
+    if socket_sink != None:
+        socket_sink.close()
+    if args.output not in (None, '-'):
+        stream.close()
+    print(json.dumps(cava.get_stats()), file=sys.stderr)
+    return 0
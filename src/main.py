@@ -28,16 +28,20 @@
 #
 # SPDX-License-Identifier: MIT
 
+import gc
+import os
 import sys
+import time
 import gi
 
 gi.require_version('Gtk', '4.0')
 gi.require_version('Adw', '1')
 
-from gi.repository import Gtk, Gio, Adw
+from gi.repository import Gtk, Gio, GLib, Adw
 from .window import CavalierWindow
-from .preferences_window import CavalierPreferencesWindow
-from .translator_credits import get_translator_credits
+from .cava import Cava
+from .settings import CavalierSettings
+from . import profiling
 
 
 class CavalierApplication(Adw.Application):
@@ -50,6 +54,20 @@ class CavalierApplication(Adw.Application):
         self.create_action('about', self.on_about_action, ['<primary>question'])
         self.create_action('preferences', self.on_preferences_action,
             ['<primary>p'])
+        self.record_action = Gio.SimpleAction.new_stateful('record', None, \
+            GLib.Variant.new_boolean(False))
+        self.record_action.connect('activate', self.on_record_action)
+        self.add_action(self.record_action)
+        self.set_accels_for_action('app.record', ['<primary>r'])
+
+    def do_startup(self):
+        """Called once when the application starts.
+
+        Cava is spawned here, so it warms up while the UI is being built.
+        """
+        Adw.Application.do_startup(self)
+        self.cava = Cava()
+        self.cava.start()
 
     def do_activate(self):
         """Called when the application is activated.
@@ -59,11 +77,41 @@ class CavalierApplication(Adw.Application):
         """
         self.win = self.props.active_window
         if not self.win:
-            self.win = CavalierWindow(application=self)
+            self.win = CavalierWindow(application=self, cava=self.cava)
+            if os.getenv('CAVALIER_STARTUP_BENCHMARK'):
+                self.win.connect('map', self.on_benchmark_window_mapped)
+                self.win.drawing_area.add_tick_callback( \
+                    self.on_benchmark_tick)
+            if os.getenv('CAVALIER_GC_FREEZE'):
+                GLib.idle_add(self.freeze_gc)
         self.win.present()
 
+    def freeze_gc(self):
+        # Objects created during startup live until exit, moving them
+        # out of garbage collector's sight makes collections cheaper
+        gc.collect()
+        gc.freeze()
+        return False
+
+    def do_shutdown(self):
+        self.cava.stop()
+        Adw.Application.do_shutdown(self)
+
+    def on_benchmark_window_mapped(self, obj):
+        # Timestamps are CLOCK_MONOTONIC, so they can be compared
+        # with the time the benchmark script launched the app
+        print(f'startup: window {time.monotonic()}', flush=True)
+
+    def on_benchmark_tick(self, widget, frame_clock):
+        if len(self.cava.sample) == 0:
+            return True
+        print(f'startup: first-frame {time.monotonic()}', flush=True)
+        self.quit()
+        return False
+
     def on_about_action(self, *args):
         """Callback for the app.about action."""
+        from .translator_credits import get_translator_credits
         about = Adw.AboutWindow(transient_for=self.props.active_window,
                                 application_name='Cavalier',
                                 application_icon='io.github.fsobolev.Cavalier',
@@ -78,6 +126,7 @@ class CavalierApplication(Adw.Application):
         about.present()
 
     def on_preferences_action(self, widget, _):
+        from .preferences_window import CavalierPreferencesWindow
         self.pref_win = None
         for w in self.get_windows():
             if type(w) == CavalierPreferencesWindow:
@@ -87,7 +136,31 @@ class CavalierApplication(Adw.Application):
             self.pref_win = CavalierPreferencesWindow(application=self)
         self.pref_win.present()
 
+    def on_record_action(self, action, _):
+        drawing_area = self.win.drawing_area
+        if action.get_state().unpack():
+            # Returns after queued frames are written
+            recorder = drawing_area.stop_recording()
+            print(f'Recording stopped: {recorder.written} frames written, ' \
+                f'{recorder.dropped} dropped')
+            action.set_state(GLib.Variant.new_boolean(False))
+            return
+        settings = CavalierSettings.new()
+        path = settings.get('recording-path')
+        if path == '':
+            directory = GLib.get_user_special_dir( \
+                GLib.UserDirectory.DIRECTORY_VIDEOS) or GLib.get_home_dir()
+            path = os.path.join(directory, \
+                time.strftime('cavalier-%Y%m%d-%H%M%S.raw'))
+        recorder = drawing_area.start_recording(path, \
+            tuple(settings.get('bg-colors')))
+        print(f'Recording to {path}, to encode it run:')
+        print(recorder.get_ffmpeg_command())
+        action.set_state(GLib.Variant.new_boolean(True))
+
     def on_quit_action(self, widget, _):
+        if self.record_action.get_state().unpack():
+            self.on_record_action(self.record_action, None)
         self.win.close()
         self.quit()
 
@@ -109,5 +182,6 @@ class CavalierApplication(Adw.Application):
 
 def main(version):
     """The application's entry point."""
+    profiling.start()
     app = CavalierApplication()
     return app.run(sys.argv)
@@ -0,0 +1,161 @@
+# post_processing.py
+#
+# Copyright 2022 Fyodor Sobolev
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE X CONSORTIUM BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# Except as contained in this notice, the name(s) of the above copyright
+# holders shall not be used in advertising or otherwise to promote the sale,
+# use or other dealings in this Software without prior written
+# authorization.
+#
+# SPDX-License-Identifier: MIT
+
+import math
+from array import array
+
+class PostProcessor:
+    """Processes samples read from cava before they are drawn.
+
+    Parameters are plain attributes that can be changed at any time from
+    another thread and are picked up on the next frame, so unlike cava
+    options they don't need a restart. State of every bar is kept in arrays
+    allocated once per number of bars, and all steps are done in a single
+    pass over the frame.
+    """
+    # Seconds a peak cap stays in place before it starts falling
+    PEAK_HOLD = 0.5
+    # Acceleration of falling peak caps (in heights per second squared)
+    PEAK_GRAVITY = 2.0
+
+    def __init__(self):
+        self.gain = 1.0
+        # Acceleration of falling bars (in heights per second squared),
+        # 0 disables it
+        self.gravity = 0.0
+        self.peak_caps = False
+        # 'linear' or 'log'
+        self.amplitude_scale = 'linear'
+        # Part of the previous frame mixed into the new one, 0 disables it
+        self.smoothing = 0.0
+        self.framerate = 60
+        self.bars = 0
+        # Whether gravity and peak caps were on in the previous frame
+        self.falling = False
+        self.holding = False
+
+    def reset(self, bars):
+        # Called for every new cava process, as number of bars can change
+        if bars != self.bars:
+            self.bars = bars
+            self.previous = array('d', bytes(8 * bars))
+            self.velocity = array('d', bytes(8 * bars))
+            self.peaks = array('d', bytes(8 * bars))
+            self.peak_velocity = array('d', bytes(8 * bars))
+            self.peak_hold = array('i', bytes(4 * bars))
+        else:
+            for i in range(bars):
+                self.previous[i] = 0.0
+                self.velocity[i] = 0.0
+                self.peaks[i] = 0.0
+                self.peak_velocity[i] = 0.0
+                self.peak_hold[i] = 0
+        self.falling = False
+        self.holding = False
+
+    def is_identity(self):
+        return self.gain == 1.0 and self.gravity == 0.0 and \
+            not self.peak_caps and self.amplitude_scale == 'linear' and \
+            self.smoothing == 0.0
+
+    def process(self, values, norm, sample, peaks):
+        # Fills `sample` (and `peaks` if caps are enabled) from raw cava
+        # `values`, returns False if peaks were not updated
+        bars = self.bars
+        previous = self.previous
+        if self.is_identity():
+            # Previous frame is still kept, so smoothing and gravity
+            # continue from the real bars when they are turned on
+            for i in range(bars):
+                previous[i] = sample[i] = values[i] * norm
+            self.falling = False
+            self.holding = False
+            return False
+        # Parameters are read once, so they don't change in the middle
+        # of a frame
+        gain = norm * self.gain
+        log_scale = self.amplitude_scale == 'log'
+        smoothing = self.smoothing
+        dt = 1 / self.framerate
+        fall = self.gravity * dt * dt
+        peak_caps = self.peak_caps
+        peak_fall = self.PEAK_GRAVITY * dt * dt
+        hold = round(self.PEAK_HOLD * self.framerate)
+        # State of a filter that was off is out of date
+        if fall > 0.0 and not self.falling:
+            for i in range(bars):
+                self.velocity[i] = 0.0
+        if peak_caps and not self.holding:
+            for i in range(bars):
+                self.peaks[i] = 0.0
+                self.peak_velocity[i] = 0.0
+                self.peak_hold[i] = 0
+        self.falling = fall > 0.0
+        self.holding = peak_caps
+        velocity = self.velocity
+        own_peaks = self.peaks
+        peak_velocity = self.peak_velocity
+        peak_hold = self.peak_hold
+        log10 = math.log10
+        for i in range(bars):
+            v = values[i] * gain
+            if log_scale:
+                # Maps 0..1 to 0..1, making quiet sounds more visible
+                v = log10(1 + 9 * v)
+            if v > 1.0:
+                v = 1.0
+            p = previous[i]
+            if smoothing > 0.0:
+                v = p * smoothing + v * (1 - smoothing)
+            if fall > 0.0:
+                if v < p:
+                    velocity[i] += fall
+                    if v < p - velocity[i]:
+                        v = p - velocity[i]
+                else:
+                    velocity[i] = 0.0
+            previous[i] = v
+            sample[i] = v
+            if peak_caps:
+                p = own_peaks[i]
+                if v >= p:
+                    p = v
+                    peak_velocity[i] = 0.0
+                    peak_hold[i] = hold
+                elif peak_hold[i] > 0:
+                    peak_hold[i] -= 1
+                else:
+                    peak_velocity[i] += peak_fall
+                    p = p - peak_velocity[i]
+                    if p < v:
+                        p = v
+                own_peaks[i] = p
+                peaks[i] = p
+        return peak_caps
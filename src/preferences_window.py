@@ -28,8 +28,10 @@
 #
 # SPDX-License-Identifier: MIT
 
-from gi.repository import Adw, Gtk, GObject, Gdk
+from gi.repository import Adw, Gtk, GObject, Gdk, GLib
 from cavalier.settings import CavalierSettings
+from cavalier.cava import get_input_methods
+from cavalier.profiling import instrument
 
 
 class CavalierPreferencesWindow(Adw.PreferencesWindow):
@@ -41,16 +43,46 @@ class CavalierPreferencesWindow(Adw.PreferencesWindow):
         self.settings = CavalierSettings.new(self.on_settings_changed)
 
         self.set_default_size(572, 518)
-        self.create_cavalier_page()
-        self.create_cava_page()
-        self.create_colors_page()
-
-    def create_cavalier_page(self):
-        self.cavalier_page = Adw.PreferencesPage.new()
-        self.cavalier_page.set_title('Cavalier')
-        self.cavalier_page.set_icon_name('image-x-generic-symbolic')
-        self.add(self.cavalier_page)
 
+        # Pages are created empty, the visible one is filled right away and
+        # the others one by one when the window is idle. All rows have to
+        # exist before the user starts searching, as search only finds rows
+        # that were already created.
+        self.cavalier_page = self.create_page('Cavalier', \
+            'image-x-generic-symbolic', self.fill_cavalier_page)
+        self.cava_page = self.create_page('CAVA', \
+            'utilities-terminal-symbolic', self.fill_cava_page)
+        self.colors_page = self.create_page(_('Colors'), \
+            'applications-graphics-symbolic', self.fill_colors_page)
+        self.connect('notify::visible-page', self.on_visible_page_changed)
+        self.on_visible_page_changed()
+        GLib.idle_add(self.fill_next_page, priority=GLib.PRIORITY_LOW)
+
+    def create_page(self, title, icon_name, fill_fn):
+        page = Adw.PreferencesPage.new()
+        page.set_title(title)
+        page.set_icon_name(icon_name)
+        page.fill_fn = fill_fn
+        self.add(page)
+        return page
+
+    def fill_page(self, page):
+        if page != None and page.fill_fn != None:
+            page.fill_fn()
+            page.fill_fn = None
+
+    def on_visible_page_changed(self, *args):
+        self.fill_page(self.get_visible_page())
+
+    def fill_next_page(self):
+        # Fills one page per call, so the window stays responsive
+        for page in (self.cavalier_page, self.cava_page, self.colors_page):
+            if page.fill_fn != None:
+                self.fill_page(page)
+                return True
+        return False
+
+    def fill_cavalier_page(self):
         self.cavalier_mode_group = Adw.PreferencesGroup.new()
         self.cavalier_mode_group.set_title(_('Drawing Mode'))
         self.cavalier_page.add(self.cavalier_mode_group)
@@ -78,16 +110,40 @@ class CavalierPreferencesWindow(Adw.PreferencesWindow):
         self.bars_row.set_activatable_widget(self.bars_check_btn)
         self.cavalier_mode_group.add(self.bars_row)
 
-        (self.wave_row, self.levels_row, self.bars_row)[ \
-            ('wave', 'levels', 'bars').index(self.settings.get('mode')) \
-            ].activate()
+        self.spectrogram_row = Adw.ActionRow.new()
+        self.spectrogram_row.set_title(_('Spectrogram'))
+        self.spectrogram_check_btn = Gtk.CheckButton.new()
+        self.spectrogram_check_btn.set_group(self.wave_check_btn)
+        self.spectrogram_row.add_prefix(self.spectrogram_check_btn)
+        self.spectrogram_row.set_activatable_widget( \
+            self.spectrogram_check_btn)
+        self.cavalier_mode_group.add(self.spectrogram_row)
+
+        (self.wave_row, self.levels_row, self.bars_row, \
+            self.spectrogram_row)[('wave', 'levels', 'bars', \
+            'spectrogram').index(self.settings.get('mode'))].activate()
         self.wave_check_btn.connect('toggled', self.on_save, 'mode', 'wave')
         self.levels_check_btn.connect('toggled', self.on_save, 'mode', 'levels')
         self.bars_check_btn.connect('toggled', self.on_save, 'mode', 'bars')
+        self.spectrogram_check_btn.connect('toggled', self.on_save, 'mode', \
+            'spectrogram')
 
         self.cavalier_group = Adw.PreferencesGroup.new()
         self.cavalier_page.add(self.cavalier_group)
 
+        self.wave_curve_row = Adw.ComboRow.new()
+        self.wave_curve_row.set_title(_('Wave curve'))
+        self.wave_curve_row.set_subtitle( \
+            _('Curve used to connect points in "wave" mode.'))
+        self.cavalier_group.add(self.wave_curve_row)
+        self.wave_curve_row.set_model(Gtk.StringList.new( \
+            [_('Bézier'), _('Smooth spline')]))
+        self.wave_curve_row.set_selected( \
+            ['bezier', 'spline'].index(self.settings.get('wave-curve')))
+        self.wave_curve_row.connect('notify::selected-item', \
+            lambda *args: self.settings.set('wave-curve', \
+            ['bezier', 'spline'][self.wave_curve_row.get_selected()]))
+
         self.pref_margin = Adw.ActionRow.new()
         self.pref_margin.set_title(_('Drawing area margin'))
         self.pref_margin.set_subtitle( \
@@ -137,12 +193,38 @@ class CavalierPreferencesWindow(Adw.PreferencesWindow):
             self.pref_sharp_corners_switch)
         self.cavalier_group.add(self.pref_sharp_corners)
 
-    def create_cava_page(self):
-        self.cava_page = Adw.PreferencesPage.new()
-        self.cava_page.set_title('CAVA')
-        self.cava_page.set_icon_name('utilities-terminal-symbolic')
-        self.add(self.cava_page)
-
+        self.pref_snapping = Adw.ActionRow.new()
+        self.pref_snapping.set_title(_('Pixel snapping'))
+        self.pref_snapping.set_subtitle( \
+            _('Align elements in "levels" and "bars" modes to pixels for sharper edges and faster drawing.'))
+        self.pref_snapping_switch = Gtk.Switch.new()
+        self.pref_snapping_switch.set_valign(Gtk.Align.CENTER)
+        self.pref_snapping_switch.set_active( \
+            self.settings.get('pixel-snapping'))
+        self.pref_snapping_switch.connect('state-set', \
+            lambda *args : self.on_save(self.pref_snapping_switch, \
+                'pixel-snapping', not self.pref_snapping_switch.get_state()))
+        self.pref_snapping.add_suffix(self.pref_snapping_switch)
+        self.pref_snapping.set_activatable_widget(self.pref_snapping_switch)
+        self.cavalier_group.add(self.pref_snapping)
+
+        self.pref_threaded = Adw.ActionRow.new()
+        self.pref_threaded.set_title(_('Threaded rendering'))
+        self.pref_threaded.set_subtitle( \
+            _('Draw frames in a background thread, so slow frames don\'t block the user interface.'))
+        self.pref_threaded_switch = Gtk.Switch.new()
+        self.pref_threaded_switch.set_valign(Gtk.Align.CENTER)
+        self.pref_threaded_switch.set_active( \
+            self.settings.get('threaded-rendering'))
+        self.pref_threaded_switch.connect('state-set', \
+            lambda *args : self.on_save(self.pref_threaded_switch, \
+                'threaded-rendering', \
+                not self.pref_threaded_switch.get_state()))
+        self.pref_threaded.add_suffix(self.pref_threaded_switch)
+        self.pref_threaded.set_activatable_widget(self.pref_threaded_switch)
+        self.cavalier_group.add(self.pref_threaded)
+
+    def fill_cava_page(self):
         self.cava_group = Adw.PreferencesGroup.new()
         self.cava_page.add(self.cava_group)
 
@@ -238,12 +320,128 @@ class CavalierPreferencesWindow(Adw.PreferencesWindow):
             'noise-reduction', self.nr_scale.get_value)
         self.nr_row.add_suffix(self.nr_scale)
 
-    def create_colors_page(self):
-        self.colors_page = Adw.PreferencesPage.new()
-        self.colors_page.set_title(_('Colors'))
-        self.colors_page.set_icon_name('applications-graphics-symbolic')
-        self.add(self.colors_page)
-
+        self.processing_group = Adw.PreferencesGroup.new()
+        self.processing_group.set_title(_('Processing'))
+        self.processing_group.set_description( \
+            _('Applied to every frame after CAVA, changes take effect immediately.'))
+        self.cava_page.add(self.processing_group)
+
+        self.gain_row = Adw.ActionRow.new()
+        self.gain_row.set_title(_('Gain'))
+        self.processing_group.add(self.gain_row)
+        self.gain_scale = Gtk.Scale.new_with_range( \
+            Gtk.Orientation.HORIZONTAL, 0.1, 5.0, 0.1)
+        self.gain_scale.add_mark(1.0, Gtk.PositionType.BOTTOM, None)
+        self.gain_scale.set_size_request(190, -1)
+        self.gain_scale.set_draw_value(True)
+        self.gain_scale.set_value_pos(Gtk.PositionType.LEFT)
+        self.gain_scale.get_first_child().set_margin_bottom(12)
+        self.gain_scale.set_value(self.settings.get('gain'))
+        self.gain_scale.connect('value-changed', self.on_save, \
+            'gain', self.gain_scale.get_value)
+        self.gain_row.add_suffix(self.gain_scale)
+
+        self.amplitude_scale_row = Adw.ComboRow.new()
+        self.amplitude_scale_row.set_title(_('Amplitude scale'))
+        self.amplitude_scale_row.set_subtitle( \
+            _('Logarithmic scale makes quiet sounds more visible.'))
+        self.processing_group.add(self.amplitude_scale_row)
+        self.amplitude_scale_row.set_model(Gtk.StringList.new( \
+            [_('Linear'), _('Logarithmic')]))
+        self.amplitude_scale_row.set_selected( \
+            ['linear', 'log'].index(self.settings.get('amplitude-scale')))
+        self.amplitude_scale_row.connect('notify::selected-item', \
+            lambda *args: self.settings.set('amplitude-scale', \
+            ['linear', 'log'][self.amplitude_scale_row.get_selected()]))
+
+        self.frame_smoothing_row = Adw.ActionRow.new()
+        self.frame_smoothing_row.set_title(_('Frame smoothing'))
+        self.frame_smoothing_row.set_subtitle(_('0 - off'))
+        self.processing_group.add(self.frame_smoothing_row)
+        self.frame_smoothing_scale = Gtk.Scale.new_with_range( \
+            Gtk.Orientation.HORIZONTAL, 0.0, 0.95, 0.05)
+        self.frame_smoothing_scale.set_size_request(190, -1)
+        self.frame_smoothing_scale.set_draw_value(True)
+        self.frame_smoothing_scale.set_value_pos(Gtk.PositionType.LEFT)
+        self.frame_smoothing_scale.set_value( \
+            self.settings.get('frame-smoothing'))
+        self.frame_smoothing_scale.connect('value-changed', self.on_save, \
+            'frame-smoothing', self.frame_smoothing_scale.get_value)
+        self.frame_smoothing_row.add_suffix(self.frame_smoothing_scale)
+
+        self.gravity_row = Adw.ActionRow.new()
+        self.gravity_row.set_title(_('Gravity'))
+        self.gravity_row.set_subtitle(_('How fast bars fall, 0 - off'))
+        self.processing_group.add(self.gravity_row)
+        self.gravity_scale = Gtk.Scale.new_with_range( \
+            Gtk.Orientation.HORIZONTAL, 0.0, 20.0, 0.5)
+        self.gravity_scale.set_size_request(190, -1)
+        self.gravity_scale.set_draw_value(True)
+        self.gravity_scale.set_value_pos(Gtk.PositionType.LEFT)
+        self.gravity_scale.set_value(self.settings.get('gravity'))
+        self.gravity_scale.connect('value-changed', self.on_save, \
+            'gravity', self.gravity_scale.get_value)
+        self.gravity_row.add_suffix(self.gravity_scale)
+
+        self.peak_caps_row = Adw.ActionRow.new()
+        self.peak_caps_row.set_title(_('Peak caps'))
+        self.peak_caps_row.set_subtitle( \
+            _('Hold the peaks of bars for a while in "bars" mode.'))
+        self.peak_caps_switch = Gtk.Switch.new()
+        self.peak_caps_switch.set_valign(Gtk.Align.CENTER)
+        self.peak_caps_switch.set_active(self.settings.get('peak-caps'))
+        self.peak_caps_switch.connect('state-set', \
+            lambda *args : self.on_save(self.peak_caps_switch, \
+                'peak-caps', not self.peak_caps_switch.get_state()))
+        self.peak_caps_row.add_suffix(self.peak_caps_switch)
+        self.peak_caps_row.set_activatable_widget(self.peak_caps_switch)
+        self.processing_group.add(self.peak_caps_row)
+
+        self.input_group = Adw.PreferencesGroup.new()
+        self.input_group.set_title(_('Input'))
+        self.cava_page.add(self.input_group)
+
+        self.input_method_row = Adw.ComboRow.new()
+        self.input_method_row.set_title(_('Capture method'))
+        self.input_group.add(self.input_method_row)
+        # PipeWire is only offered if installed cava supports it
+        self.input_methods = get_input_methods()
+        names = {'pipewire': 'PipeWire', 'pulse': 'PulseAudio', \
+            'alsa': 'ALSA', 'fifo': 'FIFO'}
+        self.input_method_row.set_model(Gtk.StringList.new( \
+            [names[m] for m in self.input_methods]))
+        method = self.settings.get('input-method')
+        if method not in self.input_methods:
+            # Cava falls back to PulseAudio in this case
+            method = 'pulse'
+        self.input_method_row.set_selected(self.input_methods.index(method))
+        self.input_method_row.connect('notify::selected-item', \
+            lambda *args: self.settings.set('input-method', \
+            self.input_methods[self.input_method_row.get_selected()]))
+
+        self.input_source_row = Adw.EntryRow.new()
+        self.input_source_row.set_title( \
+            _('Source (device, source name or FIFO path)'))
+        self.input_source_row.set_text(self.settings.get('input-source'))
+        self.input_source_row.set_show_apply_button(True)
+        self.input_source_row.connect('apply', lambda *args: \
+            self.settings.set('input-source', \
+            self.input_source_row.get_text().strip() or 'auto'))
+        self.input_group.add(self.input_source_row)
+
+        self.input_buffer_row = Adw.ActionRow.new()
+        self.input_buffer_row.set_title(_('Capture buffer'))
+        self.input_buffer_row.set_subtitle( \
+            _('Requested latency for PulseAudio and PipeWire (in milliseconds), 0 - default.'))
+        self.input_buffer_spin = Gtk.SpinButton.new_with_range(0.0, 500.0, 5.0)
+        self.input_buffer_spin.set_valign(Gtk.Align.CENTER)
+        self.input_buffer_spin.set_value(self.settings.get('input-buffer'))
+        self.input_buffer_spin.connect('value-changed', self.on_save, \
+            'input-buffer', self.input_buffer_spin.get_value)
+        self.input_buffer_row.add_suffix(self.input_buffer_spin)
+        self.input_group.add(self.input_buffer_row)
+
+    def fill_colors_page(self):
         self.style_group = Adw.PreferencesGroup.new()
         self.colors_page.add(self.style_group)
 
@@ -270,8 +468,8 @@ class CavalierPreferencesWindow(Adw.PreferencesWindow):
         self.btn_dark.connect('toggled', self.apply_style)
         self.style_group.add(self.style_row)
 
-        self.fg_colors = self.settings.get('fg-colors')
-        self.bg_colors = self.settings.get('bg-colors')
+        self.colors = [self.settings.get('fg-colors'), \
+            self.settings.get('bg-colors')]
 
         self.colors_group = Adw.PreferencesGroup.new()
         self.colors_group.set_title(_('Colors'))
@@ -291,125 +489,107 @@ class CavalierPreferencesWindow(Adw.PreferencesWindow):
         self.bg_lbl.set_margin_top(12)
         self.bg_lbl.set_margin_bottom(12)
         self.colors_grid.attach(self.bg_lbl, 1, 0, 1, 1)
-        self.fg_color_btns = []
-        self.bg_color_btns = []
-        self.fill_colors_grid()
 
-    def fill_colors_grid(self):
-        counter = 0
-        for fg_color in self.fg_colors:
-            box = Gtk.Box.new(Gtk.Orientation.HORIZONTAL, 6)
-            box.set_halign(Gtk.Align.CENTER)
-            box.set_margin_top(6)
-            box.set_margin_bottom(6)
-            color = Gdk.RGBA()
-            Gdk.RGBA.parse(color, 'rgba(%d, %d, %d, %f)' % fg_color)
-            color_btn = Gtk.ColorButton.new_with_rgba(color)
-            color_btn.set_use_alpha(True)
-            color_btn.set_size_request(98, -1)
-            color_btn.connect('color-set', self.color_changed, 0, counter)
-            box.append(color_btn)
-            rm_btn = Gtk.Button.new_from_icon_name('edit-delete-symbolic')
-            rm_btn.add_css_class('circular')
-            if counter == 0:
-                rm_btn.set_sensitive(False)
-            rm_btn.connect('clicked', self.remove_color, 0, counter)
-            box.append(rm_btn)
-            self.colors_grid.attach(box, 0, counter + 1, 1, 1)
-            counter += 1
-        if counter < 10:
-            self.fg_add_box = Gtk.Box.new(Gtk.Orientation.HORIZONTAL, 4)
-            self.fg_add_box.set_halign(Gtk.Align.CENTER)
-            self.fg_add_box.set_valign(Gtk.Align.CENTER)
-            self.fg_add_box.set_margin_bottom(6)
-            self.fg_add_box.append(Gtk.Label.new(_('Add')))
+        # Each column is a box with a row per color and a row to add
+        # a new color, so rows can be added and removed one by one
+        self.color_boxes = []
+        self.add_colorbtns = []
+        self.add_boxes = []
+        self.color_rows = [[], []]
+        for color_type in (0, 1): # 0 for fg, 1 for bg
+            color_box = Gtk.Box.new(Gtk.Orientation.VERTICAL, 0)
+            color_box.set_valign(Gtk.Align.START)
+            self.colors_grid.attach(color_box, color_type, 1, 1, 1)
+            self.color_boxes.append(color_box)
+
+            add_box = Gtk.Box.new(Gtk.Orientation.HORIZONTAL, 4)
+            add_box.set_halign(Gtk.Align.CENTER)
+            add_box.set_valign(Gtk.Align.CENTER)
+            add_box.set_margin_bottom(6)
+            add_box.append(Gtk.Label.new(_('Add')))
             color = Gdk.RGBA()
             Gdk.RGBA.parse(color, '#000f')
-            self.fg_add_colorbtn = Gtk.ColorButton.new_with_rgba(color)
-            self.fg_add_colorbtn.set_use_alpha(True)
-            self.fg_add_box.append(self.fg_add_colorbtn)
-            self.fg_add_btn = Gtk.Button.new_from_icon_name('list-add-symbolic')
-            self.fg_add_btn.add_css_class('circular')
-            self.fg_add_btn.connect('clicked', self.add_color, 0)
-            self.fg_add_box.append(self.fg_add_btn)
-            self.colors_grid.attach(self.fg_add_box, 0, counter + 1, 1, 1)
-        counter = 0
-        for bg_color in self.bg_colors:
-            box = Gtk.Box.new(Gtk.Orientation.HORIZONTAL, 6)
-            box.set_halign(Gtk.Align.CENTER)
-            box.set_margin_top(6)
-            box.set_margin_bottom(6)
-            color = Gdk.RGBA()
-            Gdk.RGBA.parse(color, 'rgba(%d, %d, %d, %f)' % bg_color)
-            color_btn = Gtk.ColorButton.new_with_rgba(color)
-            color_btn.set_use_alpha(True)
-            color_btn.set_size_request(98, -1)
-            color_btn.connect('color-set', self.color_changed, 1, counter)
-            box.append(color_btn)
-            rm_btn = Gtk.Button.new_from_icon_name('edit-delete-symbolic')
-            rm_btn.add_css_class('circular')
-            rm_btn.connect('clicked', self.remove_color, 1, counter)
-            box.append(rm_btn)
-            self.colors_grid.attach(box, 1, counter + 1, 1, 1)
-            counter += 1
-        if counter < 10:
-            self.bg_add_box = Gtk.Box.new(Gtk.Orientation.HORIZONTAL, 4)
-            self.bg_add_box.set_halign(Gtk.Align.CENTER)
-            self.bg_add_box.set_valign(Gtk.Align.CENTER)
-            self.bg_add_box.set_margin_bottom(6)
-            self.bg_add_box.append(Gtk.Label.new(_('Add')))
-            color = Gdk.RGBA()
-            Gdk.RGBA.parse(color, '#000f')
-            self.bg_add_colorbtn = Gtk.ColorButton.new_with_rgba(color)
-            self.bg_add_colorbtn.set_use_alpha(True)
-            self.bg_add_box.append(self.bg_add_colorbtn)
-            self.bg_add_btn = Gtk.Button.new_from_icon_name('list-add-symbolic')
-            self.bg_add_btn.add_css_class('circular')
-            self.bg_add_btn.connect('clicked', self.add_color, 1)
-            self.bg_add_box.append(self.bg_add_btn)
-            self.colors_grid.attach(self.bg_add_box, 1, counter + 1, 1, 1)
+            add_colorbtn = Gtk.ColorButton.new_with_rgba(color)
+            add_colorbtn.set_use_alpha(True)
+            add_box.append(add_colorbtn)
+            add_btn = Gtk.Button.new_from_icon_name('list-add-symbolic')
+            add_btn.add_css_class('circular')
+            add_btn.connect('clicked', self.add_color, color_type)
+            add_box.append(add_btn)
+            color_box.append(add_box)
+            self.add_colorbtns.append(add_colorbtn)
+            self.add_boxes.append(add_box)
+        self.fill_colors_grid()
 
-    def clear_colors_grid(self):
-        while True:
-            if (self.colors_grid.get_child_at(0, 1) != None) or \
-                    (self.colors_grid.get_child_at(1, 1) != None):
-                self.colors_grid.remove_row(1)
-            else:
-                break
+    def fill_colors_grid(self):
+        for color_type in (0, 1):
+            for color in self.colors[color_type]:
+                self.append_color_row(color_type, color)
+            self.update_color_rows(color_type)
 
-    def add_color(self, obj, color_type): # color_type 0 for fg, 1 for bg
+    def clear_colors_grid(self):
+        for color_type in (0, 1):
+            for row in self.color_rows[color_type]:
+                self.color_boxes[color_type].remove(row)
+            self.color_rows[color_type] = []
+
+    def append_color_row(self, color_type, rgba):
+        row = Gtk.Box.new(Gtk.Orientation.HORIZONTAL, 6)
+        row.set_halign(Gtk.Align.CENTER)
+        row.set_margin_top(6)
+        row.set_margin_bottom(6)
+        color = Gdk.RGBA()
+        Gdk.RGBA.parse(color, 'rgba(%d, %d, %d, %f)' % rgba)
+        color_btn = Gtk.ColorButton.new_with_rgba(color)
+        color_btn.set_use_alpha(True)
+        color_btn.set_size_request(98, -1)
+        color_btn.connect('color-set', self.color_changed, color_type, row)
+        row.append(color_btn)
+        rm_btn = Gtk.Button.new_from_icon_name('edit-delete-symbolic')
+        rm_btn.add_css_class('circular')
+        rm_btn.connect('clicked', self.remove_color, color_type, row)
+        row.append(rm_btn)
+        self.color_boxes[color_type].insert_child_after(row, \
+            self.color_rows[color_type][-1] \
+            if len(self.color_rows[color_type]) > 0 else None)
+        self.color_rows[color_type].append(row)
+
+    def update_color_rows(self, color_type):
+        # The first foreground color can't be removed,
+        # and there can be no more than 10 colors
+        rows = self.color_rows[color_type]
         if color_type == 0:
-            color = self.fg_add_colorbtn.get_rgba()
-            self.fg_colors.append((round(color.red * 255), \
-                round(color.green * 255), round(color.blue * 255), color.alpha))
-            self.settings.set('fg-colors', self.fg_colors)
-        else:
-            color = self.bg_add_colorbtn.get_rgba()
-            self.bg_colors.append((round(color.red * 255), \
-                round(color.green * 255), round(color.blue * 255), color.alpha))
-            self.settings.set('bg-colors', self.bg_colors)
+            for i in range(len(rows)):
+                rows[i].get_last_child().set_sensitive(i > 0)
+        self.add_boxes[color_type].set_visible(len(rows) < 10)
 
-    def remove_color(self, obj, color_type, index):
-        if color_type == 0:
-            self.fg_colors.pop(index)
-            self.settings.set('fg-colors', self.fg_colors)
-        else:
-            self.bg_colors.pop(index)
-            self.settings.set('bg-colors', self.bg_colors)
+    def save_colors(self, color_type):
+        self.settings.set(('fg-colors', 'bg-colors')[color_type], \
+            self.colors[color_type])
 
-    def color_changed(self, obj, color_type, index):
-        if color_type == 0:
-            self.fg_colors.pop(index)
-            color = obj.get_rgba()
-            self.fg_colors.insert(index, (round(color.red * 255), \
-                round(color.green * 255), round(color.blue * 255), color.alpha))
-            self.settings.set('fg-colors', self.fg_colors)
-        else:
-            self.bg_colors.pop(index)
-            color = obj.get_rgba()
-            self.bg_colors.insert(index, (round(color.red * 255), \
-                round(color.green * 255), round(color.blue * 255), color.alpha))
-            self.settings.set('bg-colors', self.bg_colors)
+    def rgba_to_tuple(self, color):
+        return (round(color.red * 255), round(color.green * 255), \
+            round(color.blue * 255), color.alpha)
+
+    def add_color(self, obj, color_type): # color_type 0 for fg, 1 for bg
+        color = self.rgba_to_tuple(self.add_colorbtns[color_type].get_rgba())
+        self.colors[color_type].append(color)
+        self.append_color_row(color_type, color)
+        self.update_color_rows(color_type)
+        self.save_colors(color_type)
+
+    def remove_color(self, obj, color_type, row):
+        index = self.color_rows[color_type].index(row)
+        self.colors[color_type].pop(index)
+        self.color_rows[color_type].pop(index)
+        self.color_boxes[color_type].remove(row)
+        self.update_color_rows(color_type)
+        self.save_colors(color_type)
+
+    def color_changed(self, obj, color_type, row):
+        index = self.color_rows[color_type].index(row)
+        self.colors[color_type][index] = self.rgba_to_tuple(obj.get_rgba())
+        self.save_colors(color_type)
 
     def apply_style(self, obj):
         if self.btn_light.get_active():
@@ -437,9 +617,16 @@ class CavalierPreferencesWindow(Adw.PreferencesWindow):
             value = round(value)
         self.settings.set(key, value)
 
-    def on_settings_changed(self):
-        try: # settings are initialized before colors_grid
+    @instrument
+    def on_settings_changed(self, key):
+        # Rows are updated one by one when colors are edited here, so
+        # the grid is only rebuilt if colors were changed somewhere else
+        if key not in ('fg-colors', 'bg-colors') or \
+                self.colors_page.fill_fn != None:
+            return
+        color_type = ('fg-colors', 'bg-colors').index(key)
+        colors = self.settings.get(key)
+        if colors != self.colors[color_type]:
+            self.colors[color_type] = colors
             self.clear_colors_grid()
             self.fill_colors_grid()
-        except:
-            pass
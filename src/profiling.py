@@ -0,0 +1,166 @@
+# profiling.py
+#
+# Copyright 2022 Fyodor Sobolev
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE X CONSORTIUM BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# Except as contained in this notice, the name(s) of the above copyright
+# holders shall not be used in advertising or otherwise to promote the sale,
+# use or other dealings in this Software without prior written
+# authorization.
+#
+# SPDX-License-Identifier: MIT
+
+# Optional profiler for finding out why frames are dropped.
+#
+# Set CAVALIER_PROFILE to a directory to enable it. Functions decorated with
+# @instrument then record number of calls and time spent in them, and
+# a background thread samples stacks of all threads that are inside of an
+# instrumented function. Results are written to the directory on exit and
+# on SIGUSR1:
+#
+#   cavalier-<pid>.txt        per-function statistics
+#   cavalier-<pid>.collapsed  stacks in collapsed format, can be turned into
+#                             a flamegraph with flamegraph.pl or speedscope
+#
+# When CAVALIER_PROFILE is not set, @instrument returns the function itself,
+# so it costs nothing.
+
+import os
+import sys
+import time
+import atexit
+import signal
+import functools
+import threading
+
+OUTPUT_DIR = os.getenv('CAVALIER_PROFILE')
+ENABLED = bool(OUTPUT_DIR)
+# Interval between stack samples (in seconds)
+INTERVAL = 0.002
+
+roots = set()
+timings = {}
+samples = {}
+sample_count = 0
+lock = threading.Lock()
+# Set on SIGUSR1, results are then written by the sampler thread
+dump_requested = threading.Event()
+started = False
+
+def instrument(fn):
+    if not ENABLED:
+        return fn
+    roots.add(fn.__code__)
+    name = f'{fn.__module__}.{fn.__qualname__}'
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            with lock:
+                (calls, total, longest) = timings.get(name, (0, 0.0, 0.0))
+                timings[name] = (calls + 1, total + elapsed, \
+                    max(longest, elapsed))
+    return wrapper
+
+def start():
+    global started
+    if not ENABLED or started:
+        return
+    started = True
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    threading.Thread(target=sample_loop, name='profiler', \
+        daemon=True).start()
+    atexit.register(dump)
+    # Signal handler runs in the main thread between any two bytecodes,
+    # possibly while `lock` is held there, so it must not take the lock
+    signal.signal(signal.SIGUSR1, lambda *args: dump_requested.set())
+
+def frame_name(code):
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:' \
+        f'{code.co_firstlineno})'
+
+def sample_loop():
+    global sample_count
+    me = threading.get_ident()
+    while True:
+        time.sleep(INTERVAL)
+        if dump_requested.is_set():
+            dump_requested.clear()
+            dump()
+        names = {t.ident: t.name for t in threading.enumerate()}
+        with lock:
+            sample_count += 1
+            for (ident, frame) in sys._current_frames().items():
+                if ident == me:
+                    continue
+                # Only keep the part of the stack below instrumented function
+                stack = []
+                root_found = False
+                while frame != None:
+                    stack.append(frame.f_code)
+                    if frame.f_code in roots:
+                        root_found = True
+                    frame = frame.f_back
+                if not root_found:
+                    continue
+                while stack[-1] not in roots:
+                    stack.pop()
+                key = (names.get(ident, str(ident)), tuple(reversed(stack)))
+                samples[key] = samples.get(key, 0) + 1
+
+def dump():
+    with lock:
+        timings_copy = dict(timings)
+        samples_copy = dict(samples)
+        count = sample_count
+    prefix = os.path.join(OUTPUT_DIR, f'cavalier-{os.getpid()}')
+
+    with open(prefix + '.collapsed', 'w') as f:
+        for ((thread, stack), n) in samples_copy.items():
+            f.write(';'.join([thread] + [frame_name(c) for c in stack]))
+            f.write(f' {n}\n')
+
+    own = {}
+    total = {}
+    for ((thread, stack), n) in samples_copy.items():
+        own[stack[-1]] = own.get(stack[-1], 0) + n
+        for code in set(stack):
+            total[code] = total.get(code, 0) + n
+    with open(prefix + '.txt', 'w') as f:
+        f.write('Instrumented functions\n')
+        f.write(f'{"calls":>10} {"total ms":>12} {"mean ms":>10} ' \
+            f'{"max ms":>10}  function\n')
+        for (name, (calls, spent, longest)) in sorted(timings_copy.items(), \
+                key=lambda item: -item[1][1]):
+            f.write(f'{calls:>10} {spent * 1000:>12.1f} ' \
+                f'{spent * 1000 / calls:>10.3f} {longest * 1000:>10.3f}  ' \
+                f'{name}\n')
+        f.write(f'\nSampled functions ({count} samples, ' \
+            f'{INTERVAL * 1000:g} ms interval)\n')
+        f.write(f'{"own %":>8} {"total %":>8}  function\n')
+        for code in sorted(total, key=lambda c: -total[c]):
+            f.write(f'{own.get(code, 0) * 100 / max(count, 1):>8.1f} ' \
+                f'{total[code] * 100 / max(count, 1):>8.1f}  ' \
+                f'{frame_name(code)}\n')
@@ -0,0 +1,143 @@
+# recorder.py
+#
+# Copyright 2022 Fyodor Sobolev
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE X CONSORTIUM BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# Except as contained in this notice, the name(s) of the above copyright
+# holders shall not be used in advertising or otherwise to promote the sale,
+# use or other dealings in this Software without prior written
+# authorization.
+#
+# SPDX-License-Identifier: MIT
+
+import sys
+import time
+import queue
+import cairo
+from threading import Thread
+from cavalier.draw_functions import set_source
+
+class Recorder:
+    """Records frames to a file or a pipe as raw video.
+
+    Frames are rendered into a few preallocated image surfaces and written
+    by a background thread. If all surfaces are still waiting to be written,
+    the frame is dropped, so recording never slows down drawing.
+
+    Frames are captured at `framerate` no matter how often record() is
+    called: extra calls are ignored, and a frame is written several times
+    to fill the gaps left by late or dropped frames, so the video keeps
+    the real duration.
+    """
+    # Memory for queued frames (in bytes), large frames get fewer surfaces
+    QUEUE_BYTES = 64 * 1024 * 1024
+    QUEUE_MIN = 2
+    QUEUE_MAX = 8
+
+    def __init__(self, path, width, height, framerate=60, background=()):
+        self.path = path
+        self.width = width
+        self.height = height
+        self.framerate = framerate
+        self.background = background
+        self.written = 0
+        self.dropped = 0
+        self.started = None
+        self.captured = 0
+        self.error = None
+
+        self.free = queue.Queue()
+        queue_size = min(max(self.QUEUE_BYTES // max(width * height * 4, 1), \
+            self.QUEUE_MIN), self.QUEUE_MAX)
+        for i in range(queue_size):
+            self.free.put(cairo.ImageSurface(cairo.FORMAT_ARGB32, \
+                width, height))
+        self.pending = queue.Queue()
+        self.thread = Thread(target=self.write, daemon=True)
+        self.thread.start()
+
+    def get_pixel_format(self):
+        # Cairo stores ARGB32 pixels as native-endian 32 bit integers
+        return 'bgra' if sys.byteorder == 'little' else 'argb'
+
+    def get_ffmpeg_command(self, output='output.mp4'):
+        # Most encoders need yuv420p with even width and height, so odd
+        # sizes are padded by one pixel
+        return f'ffmpeg -f rawvideo -pixel_format {self.get_pixel_format()} ' \
+            f'-video_size {self.width}x{self.height} ' \
+            f'-framerate {self.framerate} -i {self.path} ' \
+            "-vf 'pad=ceil(iw/2)*2:ceil(ih/2)*2' -pix_fmt yuv420p " \
+            f'{output}'
+
+    def record(self, draw_fn):
+        # `draw_fn(cr, width, height)` draws a frame on the given context
+        if self.error != None:
+            return
+        now = time.monotonic()
+        if self.started == None:
+            self.started = now
+        # Number of frames the video should have by now
+        due = int((now - self.started) * self.framerate) + 1
+        if due <= self.captured:
+            return
+        try:
+            surface = self.free.get_nowait()
+        except queue.Empty:
+            self.dropped += 1
+            return
+        cr = cairo.Context(surface)
+        cr.set_operator(cairo.OPERATOR_SOURCE)
+        if len(self.background) > 0:
+            set_source(cr, self.height, self.background)
+        else:
+            cr.set_source_rgba(0.0, 0.0, 0.0, 0.0)
+        cr.paint()
+        cr.set_operator(cairo.OPERATOR_OVER)
+        draw_fn(cr, self.width, self.height)
+        surface.flush()
+        self.pending.put((surface, due - self.captured))
+        self.captured = due
+
+    def stop(self, timeout=5.0):
+        # Wait until queued frames are written and the file is closed.
+        # The writer may be blocked opening a named pipe nobody reads,
+        # so it's not waited for forever.
+        self.pending.put(None)
+        self.thread.join(timeout)
+
+    def write(self):
+        try:
+            # Opening a named pipe blocks until somebody reads it,
+            # that's why it's done here
+            with open(self.path, 'wb') as f:
+                while True:
+                    item = self.pending.get()
+                    if item == None:
+                        break
+                    (surface, count) = item
+                    for i in range(count):
+                        f.write(surface.get_data())
+                    self.written += count
+                    self.free.put(surface)
+        except OSError as e:
+            print(f"Can't write recording to {self.path}")
+            print(e)
+            self.error = e
@@ -0,0 +1,103 @@
+# render_worker.py
+#
+# Copyright 2022 Fyodor Sobolev
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE X CONSORTIUM BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# Except as contained in this notice, the name(s) of the above copyright
+# holders shall not be used in advertising or otherwise to promote the sale,
+# use or other dealings in this Software without prior written
+# authorization.
+#
+# SPDX-License-Identifier: MIT
+
+import cairo
+from threading import Thread, Condition, current_thread
+
+class RenderWorker:
+    """Draws frames in a background thread.
+
+    Frames are drawn into one of two image surfaces: the front one is
+    painted by the drawing area, the back one is drawn by the worker.
+    Surfaces are only swapped by the main thread on frame clock ticks,
+    after the previous frame has been rendered.
+    """
+    def __init__(self, draw_fn):
+        # `draw_fn(cr, width, height)` draws a frame on the given context
+        self.draw_fn = draw_fn
+        self.front = None
+        self.back = None
+        self.ready = False
+        self.request = None
+        self.running = True
+        self.condition = Condition()
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def request_frame(self, width, height, scale):
+        with self.condition:
+            self.request = (width, height, scale)
+            self.condition.notify()
+
+    def swap(self):
+        # Returns True if a new frame became the front surface
+        with self.condition:
+            if not self.ready:
+                return False
+            (self.front, self.back) = (self.back, self.front)
+            self.ready = False
+            return True
+
+    def stop(self, timeout=5.0):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        # Wait for the frame being drawn, so nothing is drawn after
+        # the drawing area was torn down
+        if self.thread != current_thread():
+            self.thread.join(timeout)
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.running and (self.request == None or self.ready):
+                    self.condition.wait()
+                if not self.running:
+                    return
+                (width, height, scale) = self.request
+                self.request = None
+                surface = self.back
+            # Size changes are handled here, so the main thread never
+            # gets a surface that is being resized
+            if surface == None or \
+                    surface.get_width() != width * scale or \
+                    surface.get_height() != height * scale:
+                surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, \
+                    width * scale, height * scale)
+                surface.set_device_scale(scale, scale)
+            cr = cairo.Context(surface)
+            cr.set_operator(cairo.OPERATOR_CLEAR)
+            cr.paint()
+            cr.set_operator(cairo.OPERATOR_OVER)
+            self.draw_fn(cr, width, height)
+            surface.flush()
+            with self.condition:
+                self.back = surface
+                self.ready = True
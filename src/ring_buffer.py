@@ -0,0 +1,233 @@
+# ring_buffer.py
+#
+# Copyright 2022 Fyodor Sobolev
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE X CONSORTIUM BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# Except as contained in this notice, the name(s) of the above copyright
+# holders shall not be used in advertising or otherwise to promote the sale,
+# use or other dealings in this Software without prior written
+# authorization.
+#
+# SPDX-License-Identifier: MIT
+
+# Ring buffer for sharing spectrum frames with other local processes.
+#
+# Cavalier can publish every frame it receives from cava into a file that
+# is memory-mapped by both the writer and any number of readers (by default
+# /dev/shm/cavalier-frames-<uid>). There are no locks: there is a single
+# writer, and readers detect frames that were overwritten while being read.
+# The file is only readable by its owner and the writer refuses to use
+# a file that belongs to another user or is a symbolic link.
+#
+# All numbers use native byte order. The file starts with a 64 bytes header:
+#
+#   offset  type      field
+#   0       char[4]   magic, b'CAVR'
+#   4       uint32    version, 1
+#   8       uint32    number of slots
+#   12      uint32    maximum number of bars in a frame
+#   16      uint32    size of a slot in bytes
+#   20      uint32    framerate
+#   24      uint32    process ID of the writer, 0 after it has closed the file
+#   28      uint32    reserved
+#   32      uint64    sequence number of the latest complete frame (0 - none)
+#
+# Slots follow the header. Frame with sequence number N is in slot
+# N % slots, which starts at 64 + (N % slots) * slot_size:
+#
+#   offset  type      field
+#   0       uint64    sequence number, written before the frame data
+#   8       uint64    sequence number, written after the frame data
+#   16      uint64    timestamp (CLOCK_MONOTONIC, in nanoseconds)
+#   24      uint32    number of bars
+#   32      uint16[]  values of bars, from 0 to 65535
+#
+# To read the latest frame, read the sequence number from the header, check
+# that the second sequence number of the slot matches it, read the values
+# and check that the first sequence number of the slot still matches it.
+# If it doesn't, the writer has started reusing the slot while it was read.
+#
+# Writer process ID is cleared when Cavalier stops publishing or exits
+# normally. If it crashes, the ID stays, so readers in the same PID namespace
+# can also check that the process still exists (the Flatpak sandbox has its
+# own namespace, so its IDs don't match the ones seen outside).
+#
+# RingBufferReader below does exactly that. It can be used from Python by
+# copying this file, it only depends on the standard library:
+#
+#   reader = RingBufferReader(default_path())
+#   seq = 0
+#   while True:
+#       frame = reader.read_next(seq)
+#       if frame:
+#           seq = frame.seq
+#           bars = [v / 65535 for v in frame.values]
+#           if reader.is_valid(frame):
+#               ...
+#       time.sleep(1 / reader.framerate)
+#
+# Values of a frame can only be used until the next call to latest(),
+# read_next() or close(), copy them to keep them longer.
+
+import os
+import stat
+import time
+import mmap
+import struct
+from collections import namedtuple
+
+MAGIC = b'CAVR'
+VERSION = 1
+HEADER_SIZE = 64
+HEADER_FORMAT = '=4sIIIII'
+PID_OFFSET = 24
+HEAD_OFFSET = 32
+SLOT_HEADER_SIZE = 32
+SLOTS = 64
+MAX_BARS = 512
+
+Frame = namedtuple('Frame', ['seq', 'timestamp', 'values'])
+
+def default_path():
+    # Per-user, so other users can't create or replace the file
+    return f'/dev/shm/cavalier-frames-{os.getuid()}'
+
+def slot_size(max_bars):
+    # Keep slots 8 bytes aligned
+    return (SLOT_HEADER_SIZE + max_bars * 2 + 7) // 8 * 8
+
+class RingBufferWriter:
+    def __init__(self, path, framerate=60, slots=SLOTS, max_bars=MAX_BARS):
+        self.path = path
+        self.slots = slots
+        self.max_bars = max_bars
+        self.slot_size = slot_size(max_bars)
+        size = HEADER_SIZE + self.slots * self.slot_size
+
+        # /dev/shm is writable by everyone, so symbolic links and files
+        # created by other users are not followed
+        fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_NOFOLLOW, 0o600)
+        try:
+            st = os.fstat(fd)
+            if st.st_uid != os.getuid() or not stat.S_ISREG(st.st_mode):
+                raise PermissionError( \
+                    f'{path} is not a regular file owned by the user')
+            if st.st_mode & 0o077:
+                os.fchmod(fd, 0o600)
+            # Never shrink the file, readers may have it mapped
+            if st.st_size < size:
+                os.ftruncate(fd, size)
+            self.mm = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+
+        # Continue the sequence of the previous writer, so readers never
+        # see it going backwards
+        (magic, version, slots, max_bars, ssize, _) = \
+            struct.unpack_from(HEADER_FORMAT, self.mm, 0)
+        if (magic, version, slots, max_bars, ssize) == \
+                (MAGIC, VERSION, self.slots, self.max_bars, self.slot_size):
+            self.seq = struct.unpack_from('=Q', self.mm, HEAD_OFFSET)[0]
+        else:
+            self.seq = 0
+            struct.pack_into('=Q', self.mm, HEAD_OFFSET, 0)
+        struct.pack_into(HEADER_FORMAT, self.mm, 0, MAGIC, VERSION, \
+            self.slots, self.max_bars, self.slot_size, framerate)
+        struct.pack_into('=I', self.mm, PID_OFFSET, os.getpid())
+
+    def publish(self, data, bars):
+        # `data` is a frame from cava: `bars` 16 bit native values
+        if bars > self.max_bars:
+            bars = self.max_bars
+            data = memoryview(data)[:bars * 2]
+        self.seq += 1
+        offset = HEADER_SIZE + (self.seq % self.slots) * self.slot_size
+        struct.pack_into('=Q', self.mm, offset, self.seq)
+        struct.pack_into('=QI', self.mm, offset + 16, time.monotonic_ns(), \
+            bars)
+        start = offset + SLOT_HEADER_SIZE
+        self.mm[start:start + bars * 2] = data
+        struct.pack_into('=Q', self.mm, offset + 8, self.seq)
+        struct.pack_into('=Q', self.mm, HEAD_OFFSET, self.seq)
+
+    def close(self):
+        if self.mm.closed:
+            return
+        struct.pack_into('=I', self.mm, PID_OFFSET, 0)
+        self.mm.close()
+
+class RingBufferReader:
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, self.slots, self.max_bars, self.slot_size, \
+            self.framerate) = struct.unpack_from(HEADER_FORMAT, self.mm, 0)
+        if magic != MAGIC or version != VERSION:
+            self.mm.close()
+            raise ValueError(f'{path} is not a Cavalier ring buffer')
+        self.view = memoryview(self.mm)
+        self.values = None
+
+    def latest(self):
+        """Returns the latest frame or None if there are no frames yet.
+
+        Values of the frame point directly into the shared memory and are
+        not copied, use is_valid() after reading them to make sure they
+        weren't overwritten. They are released by the next call, so
+        the memory can be unmapped on close().
+        """
+        self.release_values()
+        seq = struct.unpack_from('=Q', self.mm, HEAD_OFFSET)[0]
+        if seq == 0:
+            return None
+        offset = HEADER_SIZE + (seq % self.slots) * self.slot_size
+        (end_seq, timestamp, bars) = \
+            struct.unpack_from('=QQI', self.mm, offset + 8)
+        if end_seq != seq:
+            return None
+        start = offset + SLOT_HEADER_SIZE
+        self.values = self.view[start:start + bars * 2].cast('H')
+        return Frame(seq, timestamp, self.values)
+
+    def release_values(self):
+        if self.values != None:
+            self.values.release()
+            self.values = None
+
+    def read_next(self, last_seq):
+        """Returns the latest frame if it's newer than `last_seq`."""
+        frame = self.latest()
+        if frame != None and frame.seq > last_seq:
+            return frame
+        return None
+
+    def writer_pid(self):
+        """Returns process ID of the writer, or 0 if it has closed the file."""
+        return struct.unpack_from('=I', self.mm, PID_OFFSET)[0]
+
+    def is_valid(self, frame):
+        offset = HEADER_SIZE + (frame.seq % self.slots) * self.slot_size
+        return struct.unpack_from('=Q', self.mm, offset)[0] == frame.seq
+
+    def close(self):
+        self.release_values()
+        self.view.release()
+        self.mm.close()
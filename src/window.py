@@ -35,13 +35,15 @@ from gi.repository import GLib
 
 from cavalier.settings import CavalierSettings
 from cavalier.drawing_area import CavalierDrawingArea
+from cavalier.profiling import instrument
 
 
 class CavalierWindow(Adw.ApplicationWindow):
     __gtype_name__ = 'CavalierWindow'
 
-    def __init__(self, **kwargs):
+    def __init__(self, cava=None, **kwargs):
         super().__init__(**kwargs)
+        self.cava = cava
 
         self.settings = CavalierSettings.new(self.on_settings_changed)
         self.cava_sample = []
@@ -73,7 +75,7 @@ class CavalierWindow(Adw.ApplicationWindow):
         self.header.set_title_widget(self.spinner)
         self.overlay.add_overlay(self.header)
 
-        self.drawing_area = CavalierDrawingArea.new()
+        self.drawing_area = CavalierDrawingArea.new(self.cava)
         self.drawing_area.spinner = self.spinner
         self.drawing_area.run()
         self.overlay.set_child(self.drawing_area)
@@ -84,6 +86,7 @@ class CavalierWindow(Adw.ApplicationWindow):
         self.header.pack_start(self.menu_button)
 
         self.menu = Gio.Menu.new()
+        self.menu.append(_('Record'), 'app.record')
         self.menu.append(_('Preferences'), 'app.preferences')
         self.menu.append(_('About'), 'app.about')
         self.menu.append(_('Quit'), 'app.quit')
@@ -123,10 +126,15 @@ class CavalierWindow(Adw.ApplicationWindow):
             self.get_style_context().add_provider(self.css_provider, \
                 Gtk.STYLE_PROVIDER_PRIORITY_USER)
 
-    def on_settings_changed(self):
-        self.toggle_sharp_corners()
-        self.set_style()
-        self.apply_colors()
+    @instrument
+    def on_settings_changed(self, key):
+        # Reloading CSS is expensive, so only do what the key needs
+        if key == 'sharp-corners':
+            self.toggle_sharp_corners()
+        elif key == 'widgets-style':
+            self.set_style()
+        elif key == 'bg-colors':
+            self.apply_colors()
 
     def on_close_request(self, obj):
         (width, height) = self.get_default_size()